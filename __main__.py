@@ -1,11 +1,39 @@
 import os
 os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = 'hide'
 
-from simsims import SimSims
+import argparse
+import json
 
 SAVE_DIRECTORY = './saves'
 
 DIMS = (1200, 800)
 
-sims = SimSims(DIMS, save_dir=SAVE_DIRECTORY)
-sims.start()
+parser = argparse.ArgumentParser(prog='SimSims')
+parser.add_argument('--headless', metavar='SAVE', help='run a saved map without a window and print a report')
+parser.add_argument('--ticks', type=int, default=600, help='number of ticks to run a headless simulation for')
+parser.add_argument('--tick-rate', type=int, default=60, help='ticks per second of the simulation')
+parser.add_argument('--time-scale', type=float, default=1, help='how many times as fast as real time the simulation runs')
+parser.add_argument('--framerate', type=int, default=60, help='frames per second that the window is rendered at')
+parser.add_argument('--scheduler', choices=('event', 'pool', 'asyncio', 'thread'), default=None,
+                    help='event runs on a virtual clock, pool, asyncio and thread run in real time (default: event when headless, else pool)')
+parser.add_argument('--vectorized', action='store_true', help='run a headless simulation on the vectorized NumPy kernel')
+parser.add_argument('--workers', type=int, default=None, help='size of the thread pool of the pool scheduler')
+args = parser.parse_args()
+
+from sim_assets import PoolScheduler, SCHEDULERS
+
+scheduler_name = args.scheduler if args.scheduler else ('event' if args.headless else 'pool')
+scheduler = PoolScheduler(args.workers) if scheduler_name == 'pool' else SCHEDULERS[scheduler_name]()
+scheduler.set_time_scale(args.time_scale)
+
+if args.headless:
+    from sim_assets import HeadlessSimulation
+
+    sim = HeadlessSimulation.from_file(args.headless, tick_rate=args.tick_rate, scheduler=scheduler, vectorized=args.vectorized)
+    print(json.dumps(sim.run(args.ticks), indent=4))
+else:
+    from simsims import SimSims
+
+    sims = SimSims(DIMS, save_dir=SAVE_DIRECTORY, scheduler=scheduler, tick_rate=args.tick_rate, framerate=args.framerate,
+                   time_scale=args.time_scale)
+    sims.start()
@@ -1,6 +1,17 @@
 from .map import Map
-from .units import Place, Container, Node, Diner, Factory, Field, Flat, Barn, Magazine, Road, Worker, Food, Product
-from .ext import ncr, bernstein_poly, colour_linear_interpolation
-from .keybindings import bindings
+from .units import ResourceBuckets, Place, Container, Node, Diner, Factory, Field, Flat, Barn, Magazine, Road, Worker, Food, Product
+from .ext import ncr, bernstein_poly, bernstein_basis, ring_layout, colour_linear_interpolation
+from .scheduler import ThreadScheduler, PoolScheduler, AsyncioScheduler, EventScheduler, SCHEDULERS
+from .kernel import VectorKernel
+from .headless import HeadlessSimulation
+from .text import TextCache, text_cache
+from .camera import Camera
+from .loop import SimulationLoop
+from .ready import ReadyQueue
+from .locks import CountedLock
 
-from .ui import UI, Button, Panel
\ No newline at end of file
+try:
+    from .keybindings import bindings
+    from .ui import UI, Button, Panel
+except ImportError:  # pygame is only required for the graphical interface
+    pass
@@ -0,0 +1,128 @@
+import random
+import sys
+import threading
+import time
+import tracemalloc
+
+from .units import ResourceBuckets, Container, Factory, Worker, Product
+from .locks import lock_stats
+
+class _LegacyResource:
+    """
+        The resource representation before flyweights, a full object with a __dict__ of name, colour and dims.
+    """
+    def __init__(self, name, colour, **kwargs):
+        self._name = name
+        self._colour = colour
+        self._dims = (8, 8)
+        self.__dict__.update(kwargs)
+
+class _Depot(Container):
+    """
+        A container that takes and gives workers without harming them, so every worker it's given is still there.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__('Depot', (Worker, ), (Worker, ), *args, **kwargs)
+
+    def insert(self, r):
+        if isinstance(r, Worker):
+            self._resources.append(r)
+            return True
+        return False
+
+def _allocated(build):
+    """
+        Returns how many bytes are still allocated by whatever build returns.
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    obj = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del obj
+    return after - before
+
+def _fill(resources, make, count):
+    for _ in range(count):
+        resources.append(make())
+    return resources
+
+def memory(count=100000):
+    """
+        Compares the memory per resource held by a place to the previous representation, a list of objects with a __dict__.
+    """
+    cases = (
+        ('Product', lambda: _LegacyResource('Product', (255, 0, 0)), Product),
+        ('Worker', lambda: _LegacyResource('Worker', (0, 0, 0), _viability=random.random()), lambda: Worker(viability=random.random()))
+    )
+    results = {}
+    for name, legacy, compact in cases:
+        before = _allocated(lambda: _fill([], legacy, count)) / count
+        after = _allocated(lambda: _fill(ResourceBuckets(), compact, count)) / count
+        results[name] = (before, after)
+        ratio = f'{before / after:.0f}x smaller' if after >= 1 else 'a constant amount in total'
+        print(f'{name.ljust(8)} {before:8.1f} -> {after:6.1f} bytes per resource ({ratio})')
+    return results
+
+def transfers(seconds=2, threads=8, workers=1000):
+    """
+        Moves workers between containers and nodes on a number of threads at once, and checks that none were lost or duplicated.
+
+        Every container is connected to every node both ways, so any two of them can be part of a transfer at the same time.
+        Another thread saves the places all the while, reading their resources the way the window draws them.
+    """
+    depots = [_Depot() for _ in range(4)]
+    nodes = [Factory() for _ in range(4)]
+    places = depots + nodes
+    for depot in depots:
+        for node in nodes:
+            depot.connect_place(node)
+            node.connect_place(depot)
+    expected = [Worker(viability=random.random()) for _ in range(workers)]
+    for i, worker in enumerate(expected):
+        depots[i % len(depots)].insert(worker)
+
+    stop = threading.Event()
+    moved = [0] * threads
+    reads = [0]
+    def move(i):
+        rng = random.Random(i)
+        while not stop.is_set():
+            depot, node = rng.choice(depots), rng.choice(nodes)
+            if rng.random() < 0.5:
+                moved[i] += depot.place_resource(node, Worker)
+            else:
+                node._has_waiting_resources = True
+                moved[i] += node.give_resources(depot)
+    def read():
+        while not stop.is_set():
+            for place in places:
+                place.json()
+            reads[0] += 1
+
+    running = [threading.Thread(target=move, args=(i, )) for i in range(threads)] + [threading.Thread(target=read)]
+    for thread in running:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in running:
+        thread.join()
+
+    found = [id(worker) for place in places for worker in place._resources.of_type(Worker)]
+    lost = len({id(worker) for worker in expected} - set(found))
+    duplicated = len(found) - len(set(found))
+    stats = lock_stats(place.lock for place in places)
+    total = sum(moved)
+    print(f'{total} transfers in {seconds}s ({total / seconds:.0f}/s) on {threads} threads, {reads[0]} reads of every place')
+    print(f'{lost} lost, {duplicated} duplicated out of {workers} workers')
+    print(f'locks taken {stats["acquired"]} times, {stats["contended"]} contended, {stats["waited"]:.3f}s waited')
+    return {'transfers': total, 'lost': lost, 'duplicated': duplicated, 'locks': stats}
+
+BENCHMARKS = {
+    'memory': memory,
+    'transfers': transfers
+}
+
+if __name__ == '__main__':
+    name = sys.argv[1] if len(sys.argv) > 1 else 'memory'
+    BENCHMARKS[name](*[int(arg) for arg in sys.argv[2:]])
@@ -0,0 +1,82 @@
+import math
+
+class Camera:
+    """
+        Which part of a map is shown, the map position at the top-left of the window and how far it's zoomed in.
+
+        Zooming goes in steps of a quarter of a power of two, so blits scaled to a zoom level can be reused.
+    """
+    ZOOM_STEPS = 4      # Zoom steps per doubling
+    MIN_ZOOM = 1 / 16
+    MAX_ZOOM = 4
+
+    def __init__(self, position=(0, 0), zoom=1):
+        self._position = tuple(position)
+        self.set_zoom(zoom)
+
+    @property
+    def position(self):
+        return self._position
+
+    @property
+    def zoom(self):
+        return self._zoom
+
+    @property
+    def key(self):
+        """
+            Changes whenever the camera moves or zooms.
+        """
+        return self._position, self._step
+
+    def set_zoom(self, zoom):
+        """
+            Sets the zoom to the nearest step between MIN_ZOOM and MAX_ZOOM.
+        """
+        zoom = min(max(zoom, self.MIN_ZOOM), self.MAX_ZOOM)
+        self._step = round(math.log2(zoom) * self.ZOOM_STEPS)
+        self._zoom = 2 ** (self._step / self.ZOOM_STEPS)
+
+    def to_world(self, x, y):
+        """
+            Returns the map position of a point (x, y) in the window.
+        """
+        zoom = self.zoom
+        return x / zoom + self._position[0], y / zoom + self._position[1]
+
+    def to_screen(self, x, y):
+        """
+            Returns the window position of a point (x, y) on the map.
+        """
+        zoom = self.zoom
+        return (x - self._position[0]) * zoom, (y - self._position[1]) * zoom
+
+    def viewport(self, dims):
+        """
+            Returns the (x, y, w, h) rectangle of the map that a window of dims shows.
+        """
+        zoom = self.zoom
+        return (*self._position, dims[0] / zoom, dims[1] / zoom)
+
+    def pan(self, dx, dy):
+        """
+            Moves the camera by (dx, dy) pixels of the window.
+        """
+        zoom = self.zoom
+        self._position = (self._position[0] + dx / zoom, self._position[1] + dy / zoom)
+
+    def zoom_at(self, steps, x, y):
+        """
+            Zooms in by a number of steps, or out if it's negative, keeping the map position under the point (x, y) of the window in place.
+        """
+        wx, wy = self.to_world(x, y)
+        self.set_zoom(2 ** ((self._step + steps) / self.ZOOM_STEPS))
+        zoom = self.zoom
+        self._position = (wx - x / zoom, wy - y / zoom)
+
+    def reset(self):
+        """
+            Moves the camera back to the origin without any zoom.
+        """
+        self._position = (0, 0)
+        self.set_zoom(1)
@@ -1,7 +1,8 @@
 
+import math
 import numpy as np
 import operator as op
-from functools import reduce
+from functools import reduce, lru_cache
 
 def ncr(n, r):
     """n choose r"""
@@ -17,6 +18,16 @@ def bernstein_poly(i, n, t):
     """
     return ncr(n, i) * (t ** (n - i)) * (1 - t)**i
     
+@lru_cache(maxsize=None)
+def bernstein_basis(n_points, n_times):
+    """
+        Returns the (n_points, n_times) matrix of Bernstein polynomials of a bezier curve, it only depends on its sizes so it's computed once.
+    """
+    t = np.linspace(0.0, 1.0, n_times)
+    basis = np.array([bernstein_poly(i, n_points-1, t) for i in range(0, n_points)])
+    basis.setflags(write=False)
+    return basis
+
 def compute_bezier_points(points, n_times=25):
     """
         Returns a list of points that can be used to construct a bezier curve.
@@ -24,13 +35,32 @@ def compute_bezier_points(points, n_times=25):
     n_points = len(points)
     x_points, y_points = np.array([p[0] for p in points]), np.array([p[1] for p in points])
 
-    t = np.linspace(0.0, 1.0, n_times)
-    polynomial_array = np.array([bernstein_poly(i, n_points-1, t) for i in range(0, n_points)])
+    polynomial_array = bernstein_basis(n_points, n_times)
 
     x_vals, y_vals = np.dot(x_points, polynomial_array), np.dot(y_points, polynomial_array)
 
     return [(x, y) for x, y in zip(x_vals, y_vals)]
 
+@lru_cache(maxsize=None)
+def ring_layout(radius, per_loop, loops, shrink=0.2):
+    """
+        Returns a read-only (slots, 2) array of offsets from the centre of a circle, filling rings from the outside in.
+
+        Ring k has a radius of radius * (1 - shrink * k), the angle of each slot is a running sum so a ring ends on the same slot as it always has.
+    """
+    delta = 2 * math.pi / per_loop
+    # A ring carries on until its running angle passes a full circle, rounding decides whether that's per_loop or per_loop + 1 slots
+    angles = np.add.accumulate(np.full(per_loop + 2, delta))
+    slots = int(np.argmax(angles > 2 * math.pi)) + 1
+    angles = np.concatenate(([0.0], angles[:slots - 1])) - math.pi / 2
+    radii = radius * (1 - shrink * np.arange(1, loops + 1))
+    layout = np.empty((loops, slots, 2))
+    layout[:, :, 0] = np.outer(radii, np.cos(angles))
+    layout[:, :, 1] = np.outer(radii, np.sin(angles))
+    layout = layout.reshape(-1, 2)
+    layout.setflags(write=False)
+    return layout
+
 def colour_linear_interpolation(col_a, col_b, t):
     """
         Linearly interpolates between two colours. 
@@ -0,0 +1,146 @@
+import json
+import time
+
+from .map import Map
+from .scheduler import EventScheduler
+from .kernel import VectorKernel
+
+class HeadlessSimulation:
+    """
+        Runs the update logic of a Map without a window, surfaces or fonts.
+
+        By default the map runs on a virtual clock, so the simulation only takes as long as the work it has to do.
+        A vectorized simulation compiles the map into a VectorKernel and writes the result back to the map when it's done.
+    """
+    def __init__(self, sim_map: Map = None, tick_rate=60, scheduler=None, vectorized=False):
+        self._map = sim_map if sim_map else Map()
+        self._map.set_scheduler(scheduler if scheduler else EventScheduler())
+        self._kernel = VectorKernel(self._map) if vectorized else None
+        self._tick_rate = tick_rate
+        self._ticks = 0
+        self._skipped = 0       # Ticks the map wasn't updated on because nothing was due on them
+        self._elapsed = 0
+        self._start_time = self.time()
+        self._tick_time = self._start_time     # The time of the clock at the last tick
+
+    @property
+    def map(self):
+        return self._map
+
+    @property
+    def ticks(self):
+        return self._ticks
+
+    def time(self):
+        """
+            Returns the current time of the simulation's clock.
+        """
+        if self._kernel:
+            return self._kernel.time()
+        return self._map.scheduler.time()
+
+    @staticmethod
+    def from_file(path, *args, **kwargs):
+        """
+            Returns a HeadlessSimulation of a map saved as a .json file.
+        """
+        with open(path, 'rb') as f:
+            obj = json.loads(f.read())
+        sim_map = Map()
+        sim_map.load_json(obj)
+        return HeadlessSimulation(sim_map, *args, **kwargs)
+
+    def tick(self):
+        """
+            Advances the clock by one tick and updates the places on the map that were woken up.
+        """
+        if self._kernel:
+            self._kernel.step(self._map.scheduler.time_scale / self._tick_rate)
+        else:
+            self._map.scheduler.tick(1 / self._tick_rate)
+            self._map.update()
+        self._ticks += 1
+
+    def run(self, ticks):
+        """
+            Runs the simulation for a number of ticks and returns a report of the result.
+
+            Ticks are paced at the tick rate if the scheduler runs on the wall clock, on a virtual clock the ticks before the next
+            due work cycle or wake-up are skipped. The report is of the clock at the last tick.
+            The work cycles still in progress are finished before the resources are read, except by the event scheduler, and
+            the time that takes is reported as drained.
+        """
+        period = 1 / self._tick_rate
+        virtual = not self._kernel and self._map.scheduler.virtual
+        paced = not self._kernel and not self._map.scheduler.virtual
+        start = time.time()
+        i = 0
+        while i < ticks:
+            self.tick()
+            i += 1
+            if virtual:
+                i += self._skip(ticks - i)
+            # Sleep until the next tick is due so the workers get the same amount of time as in a rendered simulation
+            remaining = start + i * period - time.time()
+            if paced and remaining > 0:
+                time.sleep(remaining)
+        self._tick_time = self.time()
+        if self._kernel:
+            self._kernel.write_back()
+        elif not self._map.scheduler.virtual:
+            # Work cycles run on other threads, so they're finished before their resources are read. On a virtual
+            # clock nothing runs between ticks, and finishing them would move the clock past the last tick
+            self._map._wait_threads()
+        self._elapsed += time.time() - start
+        return self.report()
+
+    def _skip(self, limit):
+        """
+            Advances the virtual clock over at most limit of the next ticks without updating the map if nothing is due on them,
+            returns how many it skipped.
+        """
+        scheduler = self._map.scheduler
+        if len(self._map.ready_queue) or not scheduler.time_scale:
+            return 0
+        due = [t for t in (scheduler.next_event(), self._map.ready_queue.next_timer()) if t is not None]
+        skipped = limit
+        if due:
+            # One tick short of the first one that is due, so rounding never lets the jump run into it
+            skipped = min(limit, int((min(due) - scheduler.time()) * self._tick_rate / scheduler.time_scale) - 1)
+        if skipped <= 0:
+            return 0
+        # Tick by tick without updating the map, so the clock adds up to exactly what it would have been
+        for _ in range(skipped):
+            scheduler.tick(1 / self._tick_rate)
+        self._ticks += skipped
+        self._skipped += skipped
+        return skipped
+
+    def report(self):
+        """
+            Returns a json dictionary describing the state of the simulation.
+        """
+        places = []
+        totals = {}
+        for place in self._map.places:
+            resources = {t.__name__: n for t, n in place.resource_counts().items()}
+            for name, n in resources.items():
+                totals[name] = totals.get(name, 0) + n
+            places.append({
+                'index': place.index,
+                'type': place.name,
+                'resources': resources
+            })
+        return {
+            'ticks': self._ticks,
+            'skipped': self._skipped,
+            'elapsed': self._elapsed,
+            'simulated': self._tick_time - self._start_time,
+            'drained': self.time() - self._tick_time,
+            'scheduler': self._map.scheduler.stats(),
+            'ready_queue': self._map.ready_queue.stats(),
+            'locks': self._map.lock_stats(),
+            'places': places,
+            'unsatisfied': [place.index for place in self._map.unsatisfied_places()],
+            'totals': totals
+        }
@@ -0,0 +1,387 @@
+import numpy as np
+
+from .units import ResourceBuckets, Node, Magazine, Barn, Road, Factory, Field, Flat, Diner, Worker, Food, Product
+
+PLACE_TYPES = (Magazine, Barn, Road, Factory, Field, Flat, Diner)
+MAGAZINE, BARN, ROAD, FACTORY, FIELD, FLAT, DINER = range(len(PLACE_TYPES))
+
+def _csr(places, index, attr):
+    """
+        Returns the (indptr, indices) pair of a compressed sparse row matrix of one of the connection lists of the places.
+    """
+    indptr = np.zeros(len(places) + 1, dtype=np.int64)
+    indices = []
+    for i, place in enumerate(places):
+        connections = getattr(place, attr)
+        indptr[i + 1] = indptr[i] + len(connections)
+        indices.extend(index[c] for c in connections)
+    return indptr, np.array(indices, dtype=np.int64)
+
+def _expand(indptr, rows):
+    """
+        Returns the owner (position in rows) and the position of every entry of the given rows of a CSR matrix, in row order.
+    """
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    owners = np.repeat(np.arange(len(rows)), lengths)
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return owners, offsets + np.arange(lengths.sum())
+
+def _rank_in_groups(groups):
+    """
+        Returns the rank of every element within its group, groups has to be sorted.
+    """
+    return np.arange(len(groups)) - np.searchsorted(groups, groups, side='left')
+
+class VectorKernel:
+    """
+        A simulation kernel that compiles a Map into NumPy arrays and advances every place in one vectorized step.
+
+        Places are stored as a struct of arrays: type codes, Food and Product counts, node timers and CSR matrices of the connections.
+        Workers are stored as arrays of their place, viability and a stamp that keeps them in first-in-first-out order.
+
+        The rules are the ones of the place classes with two simplifications:
+            - Nodes asking the same container for a resource in the same step are served in map order, a node that isn't served tries again next step.
+            - Workers delivered to a Road in the same step are damaged as if every earlier delivery in that step survived.
+
+        The map isn't changed until write_back is called.
+    """
+    def __init__(self, sim_map, seed=None):
+        sim_map._wait_threads()
+        self._map = sim_map
+        self._places = list(sim_map.places)
+        self._rng = np.random.default_rng(seed)
+        self._now = 0.0
+
+        places = self._places
+        n = len(places)
+        index = {place: i for i, place in enumerate(places)}
+        self._kind = np.array([PLACE_TYPES.index(type(p)) for p in places], dtype=np.int8)
+        self._is_node = self._kind >= FACTORY
+        self._out_indptr, self._out = _csr(places, index, '_outgoing_connections')
+        self._in_indptr, self._in = _csr(places, index, '_ingoing_connections')
+
+        # Containers update in map order, so each resource goes to the outgoing container with the lowest index that uses it
+        self._deliver_worker = self._first_outgoing(ROAD)
+        self._deliver_food = self._first_outgoing(BARN)
+        self._deliver_product = self._first_outgoing(MAGAZINE)
+        owners = np.repeat(np.arange(n), np.diff(self._out_indptr))
+        self._delivers = np.zeros(n, dtype=bool)
+        self._delivers[owners[self._kind[self._out] < FACTORY]] = True
+
+        # Node state
+        offset = sim_map.scheduler.time()
+        self._working = np.zeros(n, dtype=bool)
+        self._waiting = np.array([isinstance(p, Node) and p.waiting_resources for p in places], dtype=bool)
+        self._next_available = np.array([p._next_available - offset if isinstance(p, Node) else 0 for p in places], dtype=np.float64)
+        self._mid_at = np.full(n, np.inf)
+        self._end_at = np.full(n, np.inf)
+
+        # Resources
+        self._food = np.zeros(n, dtype=np.int64)
+        self._products = np.zeros(n, dtype=np.int64)
+        worker_places, viabilities = [], []
+        for i, place in enumerate(places):
+            counts = place.resource_counts()
+            self._food[i] = counts.get(Food, 0)
+            self._products[i] = counts.get(Product, 0)
+            place_viabilities = place.worker_viabilities()
+            worker_places.extend([i] * len(place_viabilities))
+            viabilities.extend(place_viabilities)
+        self._w_size = 0
+        self._w_place = np.zeros(0, dtype=np.int64)
+        self._w_viability = np.zeros(0, dtype=np.float64)
+        self._w_stamp = np.zeros(0, dtype=np.int64)
+        self._stamp = 0
+        self._add_workers(np.array(worker_places, dtype=np.int64), np.array(viabilities, dtype=np.float64))
+
+    @property
+    def places(self):
+        return self._places
+
+    def time(self):
+        """
+            Returns the virtual time of the kernel.
+        """
+        return self._now
+
+    def _first_outgoing(self, kind):
+        """
+            Returns, for every place, the lowest index of an outgoing place of a kind, -1 if there is none.
+        """
+        n = len(self._places)
+        owners = np.repeat(np.arange(n), np.diff(self._out_indptr))
+        mask = self._kind[self._out] == kind
+        first = np.full(n, n, dtype=np.int64)
+        np.minimum.at(first, owners[mask], self._out[mask])
+        first[first == n] = -1
+        return first
+
+    ## Workers
+    def _add_workers(self, places, viabilities):
+        """
+            Adds workers to places, growing the worker arrays if necessary.
+        """
+        count = len(places)
+        if self._w_size + count > len(self._w_place):
+            capacity = max(16, 2 * (self._w_size + count))
+            for name in ('_w_place', '_w_viability', '_w_stamp'):
+                old = getattr(self, name)
+                new = np.zeros(capacity, dtype=old.dtype)
+                new[:self._w_size] = old[:self._w_size]
+                setattr(self, name, new)
+        s = slice(self._w_size, self._w_size + count)
+        self._w_place[s] = places
+        self._w_viability[s] = viabilities
+        self._w_stamp[s] = self._stamps(count)
+        self._w_size += count
+
+    def _stamps(self, count):
+        """
+            Returns count new increasing stamps, a stamp orders the workers of a place by when they arrived.
+        """
+        stamps = np.arange(self._stamp, self._stamp + count)
+        self._stamp += count
+        return stamps
+
+    def _compact_workers(self):
+        """
+            Removes dead workers from the worker arrays once they make up most of it.
+        """
+        alive = self._w_place[:self._w_size] >= 0
+        if self._w_size > 1024 and alive.sum() * 2 < self._w_size:
+            for name in ('_w_place', '_w_viability', '_w_stamp'):
+                setattr(self, name, getattr(self, name)[:self._w_size][alive].copy())
+            self._w_size = len(self._w_place)
+
+    def _worker_mask(self, place_mask):
+        """
+            Returns a mask of the living workers that are in the places of a place mask.
+        """
+        places = self._w_place[:self._w_size]
+        return (places >= 0) & place_mask[places]
+
+    def _worker_counts(self):
+        """
+            Returns the number of workers in every place.
+        """
+        places = self._w_place[:self._w_size]
+        return np.bincount(places[places >= 0], minlength=len(self._places))
+
+    def _sorted_workers(self, worker_mask):
+        """
+            Returns the indices of the workers of a mask sorted by place and then by stamp.
+        """
+        idx = np.nonzero(worker_mask)[0]
+        return idx[np.lexsort((self._w_stamp[idx], self._w_place[idx]))]
+
+    def _first_workers(self, place_mask):
+        """
+            Returns the first worker of every place of a place mask that holds any workers.
+        """
+        idx = self._sorted_workers(self._worker_mask(place_mask))
+        places = self._w_place[idx]
+        first = np.ones(len(idx), dtype=bool)
+        first[1:] = places[1:] != places[:-1]
+        return idx[first]
+
+    ## Simulation
+    def step(self, dt):
+        """
+            Advances the kernel by dt seconds of virtual time.
+        """
+        self._now += dt
+        self._finish_work()
+        self._deliver()
+        self._fetch_and_start()
+        self._compact_workers()
+
+    def wait(self):
+        """
+            Finishes every work cycle in progress by advancing the virtual time past their last step.
+        """
+        while self._working.any():
+            self._now = max(self._now, min(self._mid_at.min(), self._end_at.min()))
+            self._finish_work()
+
+    def _finish_work(self):
+        """
+            Processes the resources of the nodes halfway through their work cycle and finishes the cycles that are done.
+        """
+        processing = self._mid_at <= self._now
+        if processing.any():
+            self._mid_at[processing] = np.inf
+            self._process(processing)
+        finished = self._end_at <= self._now
+        if finished.any():
+            self._end_at[finished] = np.inf
+            self._working[finished] = False
+            self._waiting[finished] = True
+
+    def _process(self, mask):
+        """
+            Applies the process_resources rules of every node type to the nodes of a mask.
+        """
+        n = len(self._places)
+        kind = self._kind
+
+        # Factories and Fields produce one resource per worker, workers might get hurt in the process
+        for k, t, output in ((FACTORY, Factory, self._products), (FIELD, Field, self._food)):
+            idx = np.nonzero(self._worker_mask(mask & (kind == k)))[0]
+            if not len(idx):
+                continue
+            output += np.bincount(self._w_place[idx], minlength=n)
+            dead = self._rng.random(len(idx)) < t.CHANCE_OF_ACCIDENT
+            if k == FACTORY:
+                hurt = idx[~dead]
+                self._w_viability[hurt] -= Factory.WORKER_DAMAGE
+                dead |= self._w_viability[idx] <= 0
+            self._w_place[idx[dead]] = -1
+
+        # Flats turn two workers into three, or rest a single worker, and use up their product
+        flats = mask & (kind == FLAT)
+        if flats.any():
+            counts = self._worker_counts()
+            breeding = np.nonzero(flats & (counts == 2))[0]
+            resting = np.nonzero(self._worker_mask(flats & (counts != 2)))[0]
+            self._w_viability[resting] = np.minimum(self._w_viability[resting] + Flat.VIABILITY_INCREASE, 1)
+            self._add_workers(breeding, np.ones(len(breeding)))
+            self._products[flats] = 0
+
+        # Diners feed their first worker one food, which might be poisoned
+        diners = mask & (kind == DINER)
+        if diners.any():
+            self._food[diners] -= 1
+            first = self._first_workers(diners)
+            poisoned = self._rng.random(len(first)) < Diner.FOOD_POISON_CHANCE
+            viability = np.where(poisoned, Diner.FOOD_POISON_FACTOR, 1) * self._rng.uniform(Diner.MIN_VIABILITY_INCREASE, Diner.MAX_VIABILITY_INCREASE, len(first))
+            self._w_viability[first] = np.minimum(self._w_viability[first] + viability, 1)
+
+    def _deliver(self):
+        """
+            Applies Container.update: every node that waits gives its resources to its outgoing containers.
+        """
+        giving = self._waiting & self._delivers
+        if not giving.any():
+            return
+
+        for stock, deliver in ((self._food, self._deliver_food), (self._products, self._deliver_product)):
+            src = np.nonzero(giving & (deliver >= 0) & (stock > 0))[0]
+            np.add.at(stock, deliver[src], stock[src])
+            stock[src] = 0
+
+        idx = np.nonzero(self._worker_mask(giving & (self._deliver_worker >= 0)))[0]
+        if len(idx):
+            counts = self._worker_counts()
+            src = self._w_place[idx]
+            dst = self._deliver_worker[src]
+            order = np.lexsort((self._w_stamp[idx], src, dst))
+            idx, dst = idx[order], dst[order]
+
+            # Road.insert damages a worker by the number of workers already on the road
+            on_road = counts[dst] + _rank_in_groups(dst)
+            self._w_viability[idx] -= Road.VIABILITY_REDUCTION_PER_WORKER * on_road
+            dead = self._w_viability[idx] <= 0
+            self._w_place[idx[dead]] = -1
+            self._w_place[idx[~dead]] = dst[~dead]
+            self._w_stamp[idx[~dead]] = self._stamps((~dead).sum())
+
+        giving_idx = np.nonzero(giving)[0]
+        remaining = (self._food[giving_idx] > 0) | (self._products[giving_idx] > 0) | (self._worker_counts()[giving_idx] > 0)
+        self._waiting[giving_idx] = remaining
+        self._next_available[giving_idx] = self._now + Node.COOL_DOWN
+
+    def _find_sources(self, requesters, source_kind, stock):
+        """
+            Finds the first ingoing place of a kind with stock for every requester and serves them in map order.
+
+            Returns the (nodes, sources, ranks) of the served requests, a rank is the position of the request in the queue of its source.
+        """
+        owners, positions = _expand(self._in_indptr, requesters)
+        src = self._in[positions]
+        ok = (self._kind[src] == source_kind) & (stock[src] > 0)
+        owners, src = owners[ok], src[ok]
+        owners, first = np.unique(owners, return_index=True)
+        nodes, sources = requesters[owners], src[first]
+
+        order = np.lexsort((nodes, sources))
+        nodes, sources = nodes[order], sources[order]
+        ranks = _rank_in_groups(sources)
+        served = ranks < stock[sources]
+        return nodes[served], sources[served], ranks[served]
+
+    def _take_stock(self, requesters, source_kind, stock):
+        """
+            Moves one Food or Product from a source to every requester that can be served.
+        """
+        nodes, sources, _ = self._find_sources(requesters, source_kind, stock)
+        np.subtract.at(stock, sources, 1)
+        stock[nodes] += 1
+
+    def _take_workers(self, requesters):
+        """
+            Moves the first worker of a Road to every requester that can be served, returns the served nodes.
+        """
+        nodes, roads, ranks = self._find_sources(requesters, ROAD, self._worker_counts())
+        if len(nodes):
+            idx = self._sorted_workers(self._worker_mask(self._kind == ROAD))
+            first = np.searchsorted(self._w_place[idx], roads, side='left')
+            moved = idx[first + ranks]
+            self._w_place[moved] = nodes
+            self._w_stamp[moved] = self._stamps(len(moved))
+        return nodes
+
+    def _fetch_and_start(self):
+        """
+            Applies Node.update: nodes that are ready fetch resources and start working if they have what they need.
+        """
+        kind = self._kind
+        ready = self._is_node & ~self._working & ~self._waiting & (self._next_available < self._now)
+        if not ready.any():
+            return
+
+        workers = self._worker_counts()
+        food, products = self._food.copy(), self._products.copy()
+        producers = ready & ((kind == FACTORY) | (kind == FIELD))
+        flats = ready & (kind == FLAT)
+        diners = ready & (kind == DINER)
+
+        self._take_stock(np.nonzero(flats & (products == 0))[0], MAGAZINE, self._products)
+        self._take_stock(np.nonzero(diners & (food == 0))[0], BARN, self._food)
+        wants_worker = (producers & (workers + food + products == 0)) | (flats & (products != 0) & (workers == 0)) | (diners & (workers == 0))
+        served = self._take_workers(np.nonzero(wants_worker)[0])
+
+        # Flats sometimes ask for a second worker
+        served = served[kind[served] == FLAT]
+        self._take_workers(served[self._rng.random(len(served)) <= Flat.CHANCE_OF_TWO_WRKR])
+
+        # Factories and Fields start on what they have after fetching, Flats and Diners on what they had before
+        start = (producers & (self._worker_counts() > 0)) | (flats & (products == 1) & ((workers == 1) | (workers == 2))) | (diners & (food > 0) & (workers > 0))
+        if not start.any():
+            return
+        duration = np.full(len(self._places), Node.WORK_DELAY / 2)
+        first = self._first_workers(producers & start)
+        # map_from_to(viability, 0, 1, 2, 1) of the first worker, as in Factory.work_duration
+        duration[self._w_place[first]] *= 2 - self._w_viability[first]
+        self._working[start] = True
+        self._mid_at[start] = self._now + duration[start]
+        self._end_at[start] = self._mid_at[start] + Node.WORK_DELAY / 2
+
+    def write_back(self):
+        """
+            Finishes the work in progress and writes the resources and node state back to the places of the map.
+        """
+        self.wait()
+        offset = self._map.scheduler.time() - self._now
+        idx = self._sorted_workers(self._w_place[:self._w_size] >= 0)
+        places = self._w_place[idx]
+        bounds = np.searchsorted(places, np.arange(len(self._places) + 1), side='left')
+        for i, place in enumerate(self._places):
+            resources = ResourceBuckets(Worker(viability=float(v)) for v in self._w_viability[idx[bounds[i]:bounds[i + 1]]])
+            resources.add_count(Food, int(self._food[i]))
+            resources.add_count(Product, int(self._products[i]))
+            place._resources = resources
+            if self._is_node[i]:
+                place._working = False
+                place._has_waiting_resources = bool(self._waiting[i])
+                place._next_available = float(self._next_available[i]) + offset
@@ -15,6 +15,20 @@ class Keybindings:
     LOAD_SCREEN = pygame.K_l
     KEYBINDING_SCREEN = pygame.K_TAB 
 
+    PAN_UP = pygame.K_UP
+    PAN_DOWN = pygame.K_DOWN
+    PAN_LEFT = pygame.K_LEFT
+    PAN_RIGHT = pygame.K_RIGHT
+    ZOOM_IN = pygame.K_EQUALS
+    ZOOM_OUT = pygame.K_MINUS
+    WHEEL_ZOOM_IN = pygame.BUTTON_WHEELUP      # The wheel is reported as mouse buttons 4 and 5, pygame 1.9 has no MOUSEWHEEL event
+    WHEEL_ZOOM_OUT = pygame.BUTTON_WHEELDOWN
+    RESET_CAMERA = pygame.K_HOME
+
+    FASTER = pygame.K_PERIOD
+    SLOWER = pygame.K_COMMA
+    MAX_SPEED = pygame.K_m
+
     SELECT_TYPE_MAGAZINE = pygame.K_1
     SELECT_TYPE_BARN     = pygame.K_2
     SELECT_TYPE_ROAD     = pygame.K_3
@@ -34,7 +48,9 @@ class Keybindings:
         m = {
             pygame.BUTTON_LEFT: 'Mouse Left',
             pygame.BUTTON_RIGHT: 'Mouse Right',
-            pygame.BUTTON_MIDDLE: 'Mouse Middle'
+            pygame.BUTTON_MIDDLE: 'Mouse Middle',
+            pygame.BUTTON_WHEELUP: 'Mouse Wheel Up',
+            pygame.BUTTON_WHEELDOWN: 'Mouse Wheel Down'
         }
         if key in m:
             return m[key]
@@ -0,0 +1,61 @@
+import threading
+import time
+
+class CountedLock:
+    """
+        A lock that counts how often it was taken, how often a thread had to wait for it and for how long.
+
+        The counters are only changed while the lock is held, so they don't need a lock of their own.
+    """
+    __slots__ = ('_lock', '_acquired', '_contended', '_waited')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._acquired = 0
+        self._contended = 0
+        self._waited = 0.0
+
+    def acquire(self):
+        if self._lock.acquire(False):
+            self._acquired += 1
+            return True
+        start = time.perf_counter()
+        self._lock.acquire()
+        self._acquired += 1
+        self._contended += 1
+        self._waited += time.perf_counter() - start
+        return True
+
+    def release(self):
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *args):
+        self._lock.release()
+
+    def stats(self):
+        """
+            Returns a dictionary of counters describing the lock.
+        """
+        return {'acquired': self._acquired, 'contended': self._contended, 'waited': self._waited}
+
+def lock_stats(locks):
+    """
+        Returns the counters of a number of locks added up.
+    """
+    totals = {'acquired': 0, 'contended': 0, 'waited': 0.0}
+    for lock in locks:
+        for k, v in lock.stats().items():
+            totals[k] += v
+    return totals
+
+def ordered_locks(*places):
+    """
+        Returns the locks of the places in the order every thread takes them in, so two transfers never wait on each other in a circle.
+    """
+    return [place.lock for place in sorted(places, key=id)]
@@ -0,0 +1,186 @@
+import threading
+import time
+
+class SimulationLoop:
+    """
+        Updates a map at a fixed tick rate on a thread of its own, independently of how often the map is rendered.
+
+        Every tick advances the scheduler by exactly one period. The time that passes on the wall clock is added to an accumulator
+        and as many ticks are run as fit in it, so slow frames or a slow tick are caught up with instead of slowing down the simulation.
+        Anything that reads or changes the map while the loop runs should hold the loop's lock, no tick runs while it's held,
+        so a renderer holding it draws a consistent snapshot of the map.
+
+        The time scale makes the scheduler's clock, and so every work cycle and cool-down, run faster or slower.
+        At max speed a virtual clock is ticked back to back. Schedulers on the wall clock run at MAX_TIME_SCALE and keep the tick rate,
+        more ticks wouldn't make their clock go any faster.
+    """
+    MAX_LAG = 0.25  # Seconds of ticks that are caught up with at most, anything beyond that is dropped
+    TIME_SCALES = (0.25, 0.5, 1, 2, 5, 10, 25, 50, 100)
+    MAX_TIME_SCALE = 100
+    MAX_SPEED_BATCH = 0.01  # Seconds of ticks that run at max speed before the lock is let go of
+
+    def __init__(self, sim_map, tick_rate=60):
+        self._map = sim_map
+        self._tick_rate = tick_rate
+        self._time_scale = sim_map.scheduler.time_scale
+        self._max_speed = False
+        self._lock = threading.RLock()
+        self._stop = None       # Set when the running thread should stop, every thread gets its own
+        self._thread = None
+
+        # Counters
+        self._ticks = 0
+        self._dropped = 0
+        self._measured_rate = 0
+
+    @property
+    def lock(self):
+        return self._lock
+
+    @property
+    def tick_rate(self):
+        return self._tick_rate
+
+    @property
+    def time_scale(self):
+        return self._time_scale
+
+    @property
+    def max_speed(self):
+        return self._max_speed
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    @property
+    def ticks(self):
+        return self._ticks
+
+    def set_tick_rate(self, tick_rate):
+        """
+            Sets how many ticks are run per second, it applies from the next tick on.
+        """
+        self._tick_rate = tick_rate
+
+    def set_time_scale(self, time_scale):
+        """
+            Sets how many times as fast as real time the simulation runs.
+        """
+        with self._lock:
+            self._time_scale = time_scale
+            self._apply_time_scale()
+
+    def faster(self):
+        """
+            Moves to the next time scale in TIME_SCALES, if there is one.
+        """
+        faster = [scale for scale in self.TIME_SCALES if scale > self._time_scale]
+        if faster:
+            self.set_time_scale(faster[0])
+
+    def slower(self):
+        """
+            Moves to the previous time scale in TIME_SCALES, if there is one.
+        """
+        slower = [scale for scale in self.TIME_SCALES if scale < self._time_scale]
+        if slower:
+            self.set_time_scale(slower[-1])
+
+    def set_max_speed(self, max_speed):
+        """
+            Turns running the simulation as fast as possible on or off.
+        """
+        with self._lock:
+            self._max_speed = max_speed
+            self._apply_time_scale()
+
+    def _apply_time_scale(self):
+        """
+            Sets the time scale of the map's scheduler, a virtual clock only needs more ticks to go faster.
+        """
+        scheduler = self._map.scheduler
+        if self._max_speed and not scheduler.virtual:
+            scheduler.set_time_scale(self.MAX_TIME_SCALE)
+        else:
+            scheduler.set_time_scale(self._time_scale)
+
+    def stats(self):
+        """
+            Returns a dictionary of counters describing the loop.
+        """
+        return {
+            'ticks': self._ticks,
+            'tick_rate': self._tick_rate,
+            'time_scale': self._time_scale,
+            'max_speed': self._max_speed,
+            'measured_tick_rate': self._measured_rate,
+            'dropped': self._dropped
+        }
+
+    def tick(self, dt):
+        """
+            Advances the scheduler by dt seconds and updates the places on the map that were woken up.
+        """
+        with self._lock:
+            self._map.scheduler.tick(dt)
+            self._map.update()
+            self._ticks += 1
+
+    def start(self):
+        """
+            Starts running ticks on the loop's thread.
+        """
+        if self._thread:
+            return
+        self._apply_time_scale()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(self._stop, ), name='SimSimsLoop', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+            Stops running ticks, once it returns no tick is running and no other tick will be.
+
+            It doesn't join the thread, so it can be called while holding the lock, the thread exits the next time it takes the lock.
+        """
+        with self._lock:
+            if self._thread:
+                self._stop.set()
+                self._thread = None
+
+    def _run(self, stop):
+        """
+            Runs ticks until stop is set, sleeping whenever the next tick isn't due yet.
+        """
+        accumulator = 0
+        previous = time.perf_counter()
+        measured_from, measured_ticks = previous, self._ticks
+        while not stop.is_set():
+            period = 1 / self._tick_rate
+            now = time.perf_counter()
+            accumulator += now - previous
+            previous = now
+            if now - measured_from >= 1:
+                self._measured_rate = (self._ticks - measured_ticks) / (now - measured_from)
+                measured_from, measured_ticks = now, self._ticks
+
+            if self._max_speed and self._map.scheduler.virtual:
+                # Run a batch of ticks and let go of the lock for a moment, so the window can still be drawn
+                with self._lock:
+                    while not stop.is_set() and time.perf_counter() - now < self.MAX_SPEED_BATCH:
+                        self.tick(period)
+                accumulator = 0
+                stop.wait(0.001)
+                continue
+            if accumulator > self.MAX_LAG:
+                self._dropped += int((accumulator - self.MAX_LAG) / period)
+                accumulator = self.MAX_LAG
+
+            while accumulator >= period:
+                with self._lock:
+                    if stop.is_set():
+                        return
+                    self.tick(period)
+                accumulator -= period
+            stop.wait(period - accumulator)
@@ -1,38 +1,110 @@
 
-import pygame
+try:
+    import pygame
+except ImportError:  # Headless simulations don't need pygame
+    pygame = None
 from .ext import map_from_to, compute_bezier_points, colour_linear_interpolation
 import math
 import time
 import threading
 import random
+import itertools
+import numpy as np
 
 from .units import *
+from .scheduler import PoolScheduler
+from .spatial import SpatialGrid
+from .camera import Camera
+from .text import text_cache
+from .ready import ReadyQueue
+from .locks import lock_stats
+
+def _overlaps(rect, other):
+    """
+        Returns whether two (x, y, w, h) rectangles overlap, unlike pygame.Rect it works with fractions.
+    """
+    return rect[0] < other[0] + other[2] and other[0] < rect[0] + rect[2] and rect[1] < other[1] + other[3] and other[1] < rect[1] + rect[3]
 
 class Map:
-    def __init__(self):
-        self._places = []
+    DETAIL_ZOOM = 0.75  # Zoomed out further than this the resources of every place are drawn as a summary
+    LABEL_ZOOM = 0.5    # Zoomed out further than this the names of the places aren't drawn
+
+    def __init__(self, scheduler=None):
+        self._places = {}               # Stable ID -> place, in the order they were added
+        self._next_id = 0
+        self._grid = SpatialGrid()      # Spatial index of the places for hit-testing
+        self._place_order = {}          # Place -> when it was added, the place added last is drawn on top
+        self._order_counter = itertools.count()
+        self._scheduler = scheduler if scheduler else PoolScheduler()  # Keeps the time and runs the work of the places
+        self._owns_scheduler = not scheduler    # The map shuts down a scheduler it made itself once it's replaced
+        self._ready = ReadyQueue(self._place_order)   # The places to update on the next tick
         self._selected_build_type = None        # Which type to build
         self._selected_resource_type = None     # Which resource to place 
         self._selected_place = None             # Which place is currently selected
         
+        # The previews are rendered the first time they are needed so a Map can be used without a display
         self._selected_previews = {}
-        for buildable in (Magazine, Barn, Road, Diner, Factory, Field, Flat):
-            b = buildable(set_index=False)
-            blit = b.blit()
-            blit.fill((0, 180, 220, 100), special_flags=pygame.BLEND_RGBA_MULT)
-            self._selected_previews[buildable] = (blit, b.name)
+        self._place_blits = {}  # Cached (key, blit) pairs of every place with its name and selection drawn on it
+
+        # Connections are indexed by their bounds, so the ones crossing the view are found without looking at their places
+        self._connection_grid = SpatialGrid()
+        self._connection_lines = {}     # (place, other) -> (endpoints, bezier control points, (x, y, w, h) bounds) of every connection
+        self._connection_segments = {}  # (place, other) -> line segments of the connections that have been drawn
+        self._indexed_connections = {}  # Place -> (revision, connections) of its outgoing connections as they were indexed
+        self._index_version = 0         # Increased whenever the places or connections in the indexes change
+        self._connections_indexed = True    # False after a load until the first render indexes every connection
+        self._visible = None            # (viewport, index version, places, connections) of the last view
+
+        # Which part of the map is shown, the blits of the places are scaled to its zoom
+        self._camera = Camera()
+        self._static_blits = {}     # Place -> (key, blit) of its scaled blit without resources
+        self._resource_blits = {}   # Place -> (key, blit) of its scaled resources
+        self._selected_blits = {}   # Place -> (key, blit) of its scaled blit with its name and selection
+
+        # The surface of the map is kept between frames and only the parts that changed are redrawn
+        self._surface = None
+        self._static_layer = None   # Connections and places without their resources
+        self._static_key = None     # What the static layer was last drawn from
+        self._drawn_places = {}     # Place -> (key, rect) as it was last drawn on the surface
 
     @property
     def places(self):
-        return self._places
+        """
+            A read-only view of the places, in the order they were added.
+        """
+        return self._places.values()
+
+    @property
+    def scheduler(self):
+        return self._scheduler
 
-    def _wait_threads(self):
+    @property
+    def camera(self):
+        return self._camera
+
+    @property
+    def ready_queue(self):
+        return self._ready
+
+    def set_scheduler(self, scheduler):
+        """
+            Replaces the scheduler of the map and all of its places.
+        """
+        self._wait_threads()
+        if self._owns_scheduler and scheduler is not self._scheduler:
+            self._scheduler.shutdown()
+        self._scheduler = scheduler
+        self._owns_scheduler = False
+        for place in self._places.values():
+            place.set_scheduler(scheduler)
+
+    def _wait_threads(self, timeout=None):
         """
             Waits for any places that aren't finished with their current transition to finish the transition.
+
+            Returns False if the timeout ran out before they all finished.
         """
-        for place in self._places:
-            while place.working:
-                pass
+        return self._scheduler.wait(self._places.values(), timeout)
 
     def select_build_type(self, t):
         """
@@ -68,14 +140,88 @@ class Map:
 
     def get_place_at(self, x, y):
         """
-            Returns the place which contains the point (x, y), None if there is no such place.
+            Returns the place which contains the point (x, y), None if there is no such place. If places overlap the topmost one is returned.
         """
         place = None
-        for p in self._places:
-            if p.point_in_place(x, y):
+        for p in self._grid.at(x, y):
+            if p.point_in_place(x, y) and (place is None or self._place_order[p] > self._place_order[place]):
                 place = p
         return place
 
+    def get_place(self, place_id):
+        """
+            Returns the place with a stable ID, None if there is no such place.
+        """
+        return self._places.get(place_id)
+
+    def lock_stats(self):
+        """
+            Returns the counters of the locks of every place added up, how often they were taken and how often and long a thread waited.
+        """
+        return lock_stats(place.lock for place in self._places.values())
+
+    def unsatisfied_places(self):
+        """
+            Returns the places that are missing a connection they need to operate properly, in the order they were added.
+        """
+        return [place for place in self._places.values() if not place.has_required_connections()]
+
+    def _add_place(self, place):
+        """
+            Adds a place to the map and the spatial index. It keeps its ID unless it has none or another place has it.
+        """
+        if place.index < 0 or place.index in self._places:
+            place.set_index(self._next_id)
+        self._next_id = max(self._next_id, place.index + 1)
+        self._places[place.index] = place
+        self._place_order[place] = next(self._order_counter)
+        self._grid.insert(place, (*place.position, *place.dims()))
+        self._index_version += 1
+        place.set_ready_queue(self._ready)
+        place.wake()
+
+    def update(self):
+        """
+            Updates the places that were woken up since the last tick, in the order they were added.
+        """
+        for place in self._ready.pop(self._scheduler.time()):
+            place.update()
+
+    def _index_connections(self, place):
+        """
+            Brings the connection index up to date with the outgoing connections of a place, or removes them if it isn't on the map.
+        """
+        _, connections = self._indexed_connections.pop(place, (None, ()))
+        old_lines = {}
+        for connection in connections:
+            self._connection_grid.remove(connection)
+            old_lines[connection] = self._connection_lines.pop(connection)
+
+        if place in self._place_order:
+            connections = dict.fromkeys((place, other) for other in place.outgoing_connections)
+            for connection, endpoints in zip(connections, place.connection_points()):
+                lines = old_lines.pop(connection, None)
+                if lines is None or lines[0] != endpoints:
+                    self._connection_segments.pop(connection, None)
+                    lines = (endpoints, *self._bezier_curve(*endpoints))
+                self._connection_lines[connection] = lines
+                self._connection_grid.insert(connection, lines[2])
+            self._indexed_connections[place] = (place.revision[0], connections)
+        for connection in old_lines:
+            self._connection_segments.pop(connection, None)
+        self._index_version += 1
+
+    def _unindex_connection(self, connection):
+        """
+            Removes a single (place, other) connection from the connection index, without going through the other connections of the place.
+        """
+        self._connection_grid.remove(connection)
+        self._connection_lines.pop(connection, None)
+        self._connection_segments.pop(connection, None)
+        _, connections = self._indexed_connections.get(connection[0], (None, {}))
+        connections.pop(connection, None)
+        self._index_version += 1
+
     def disconnect_from_selection(self, x, y):
         """
             Disconnects the currently selected place from whichever place contains the point (x, y)
@@ -84,6 +230,8 @@ class Map:
             place = self.get_place_at(x, y)
             if place:
                 self._selected_place.disconnect_place(place)
+                self._index_connections(self._selected_place)
+                self._index_connections(place)
 
     def delete_place_at(self, x, y):
         """
@@ -91,8 +239,23 @@ class Map:
         """
         place = self.get_place_at(x, y)
         if place:
-            place.disconnect_all_connections()
-            self._places.remove(place)
+            self.remove_place(place)
+
+    def remove_place(self, place):
+        """
+            Removes a place from the map and disconnects it, it only takes as long as the place has connections.
+        """
+        # Only the places with a connection to it lose one of their own connections
+        suppliers = list(place.ingoing_connections)
+        place.disconnect_all_connections()
+        del self._places[place.index]
+        self._place_order.pop(place)
+        self._grid.remove(place)
+        self._index_connections(place)
+        for supplier in suppliers:
+            self._unindex_connection((supplier, place))
+        for blits in (self._place_blits, self._static_blits, self._resource_blits, self._selected_blits):
+            blits.pop(place, None)
 
     def can_build(self):
         """
@@ -108,83 +271,289 @@ class Map:
             t = self._selected_build_type()
             w, h = t.dims()
             t.set_position((x, y))
-            self._places.append(t)
+            t.set_scheduler(self._scheduler)
+            self._add_place(t)
         elif self._selected_resource_type:
             place = self.get_place_at(x, y)
             if place:
                 r = self._selected_resource_type()
-                place.insert(r)
+                with place.lock:
+                    place.insert(r)
+                place.wake()
         elif self._selected_place:
             place = self.get_place_at(x, y)
             if place:
                 self._selected_place.connect_place(place)
+                self._index_connections(self._selected_place)
     
     def selected_build_preview(self):
         """
             Returns a (blit, name) preview pair of the selected object. Returns (None, "") if no building is selected.
         """
         if self._selected_build_type:
+            if not self._selected_build_type in self._selected_previews:
+                b = self._selected_build_type()
+                blit = b.blit().copy()
+                blit.fill((0, 180, 220, 100), special_flags=pygame.BLEND_RGBA_MULT)
+                self._selected_previews[self._selected_build_type] = (blit, b.name)
             blit, name = self._selected_previews[self._selected_build_type]
             return blit, name
         return None, ''
 
-    def blit(self, dims, text_font: pygame.font.Font):
+    def blit(self, dims, text_font: 'pygame.font.Font'):
         """
             Returns the blit of the map.
         """
-        surface = pygame.Surface(dims, pygame.SRCALPHA, 32).convert_alpha()
-        for place in self._places:
-            pairs = place.connection_points()
-            for a, b in pairs:
-                self._draw_bezier(surface, a, b)
-        for place in self._places:
-            blit = place.blit()
+        return self.render(dims, text_font)[0]
+
+    def render(self, dims, text_font: 'pygame.font.Font'):
+        """
+            Brings the blit of the map up to date and returns it with a list of the rectangles that changed since the last call.
+
+            Only the places and connections in the view of the camera are drawn. The blit is composited from two layers.
+            The static layer holds the connections and the places without their resources, it's only rebuilt when the camera moves
+            or a place in view is added, removed, moved or (dis)connected. The resources and the selection are drawn on top
+            of it and only redrawn in the rectangles of the places that changed.
+        """
+        full = False
+        if not self._surface or self._surface.get_size() != tuple(dims):
+            self._surface = pygame.Surface(dims, pygame.SRCALPHA, 32).convert_alpha()
+            self._static_layer = pygame.Surface(dims, pygame.SRCALPHA, 32).convert_alpha()
+            full = True
+
+        if not self._connections_indexed:
+            # A loaded map is only indexed once it's drawn, so loading it without a window doesn't compute curves it never uses
+            for place in self._places.values():
+                self._index_connections(place)
+            self._connections_indexed = True
+
+        viewport = self._camera.viewport(dims)
+        places, rects, connections = self._visible_in(viewport)
+        revisions = [place.revision for place in places]
+        # Places can be (dis)connected without going through the map, their connections are indexed again once they're in view
+        stale = [place for place, revision in zip(places, revisions) if self._indexed_connections.get(place, (None, ))[0] != revision[0]]
+        if stale:
+            for place in stale:
+                self._index_connections(place)
+            places, rects, connections = self._visible_in(viewport)
+
+        static_key = (self._camera.key, tuple((place, revision[0], tuple(place.position)) for place, revision in zip(places, revisions)),
+                      tuple(connections), text_font)
+        if full or static_key != self._static_key:
+            self._rebuild_static_layer(places, connections, text_font)
+            self._static_key = static_key
+            full = True
+
+        # Places whose resources or selection changed
+        dirty = []
+        drawn_places = {}
+        for place, revision, rect in zip(places, revisions, rects):
+            key = (revision, place == self._selected_place)
+            if self._drawn_places.get(place) != (key, rect):
+                dirty.append(rect)
+            drawn_places[place] = (key, rect)
+        self._drawn_places = drawn_places
+
+        if full:
+            dirty = [self._surface.get_rect()]
+            self._redraw_rect(dirty[0], text_font, places)
+            return self._surface, dirty
+        if len(dirty) > 32:
+            dirty = [dirty[0].unionall(dirty[1:])]
+        for rect in dirty:
+            self._redraw_rect(rect, text_font)
+        return self._surface, dirty
+
+    def _visible_in(self, viewport):
+        """
+            Returns the places in drawing order, the rectangles of the window they cover and the connections in drawing order
+            that overlap a (x, y, w, h) rectangle of the map.
+        """
+        if self._visible and self._visible[:2] == (viewport, self._index_version):
+            return self._visible[2:]
+        places = [place for place in self._grid.query(viewport) if _overlaps((*place.position, *place.dims()), viewport)]
+        places.sort(key=self._place_order.get)
+        rects = [self._screen_rect(place).inflate(2, 2) for place in places]
+        connections = [c for c in self._connection_grid.query(viewport) if _overlaps(self._connection_lines[c][2], viewport)]
+        connections.sort(key=lambda c: (self._place_order[c[0]], self._place_order[c[1]]))
+        self._visible = (viewport, self._index_version, places, rects, connections)
+        return places, rects, connections
+
+    def _scaled_size(self, dims):
+        """
+            Returns the size of something of dims on the map in the window.
+        """
+        zoom = self._camera.zoom
+        if zoom == 1:
+            return tuple(dims)
+        return max(1, round(dims[0] * zoom)), max(1, round(dims[1] * zoom))
+
+    def _screen_rect(self, place):
+        """
+            Returns the rectangle of the window that a place covers.
+        """
+        return pygame.Rect(self._camera.to_screen(*place.position), self._scaled_size(place.dims()))
+
+    def _scaled_blit(self, blits, place, key, draw):
+        """
+            Returns the blit that draw returns scaled to the zoom of the camera, it's only redrawn if the key or the zoom changed.
+        """
+        zoom = self._camera.zoom
+        if zoom == 1:
+            return draw()
+        key = (key, zoom)
+        cached = blits.get(place)
+        if cached and cached[0] == key:
+            return cached[1]
+        blit = draw()
+        if blit:
+            blit = pygame.transform.smoothscale(blit, self._scaled_size(blit.get_size()))
+        blits[place] = (key, blit)
+        return blit
+
+    def _draw_resources(self, place):
+        """
+            Returns a blit of only the resources of a place, at zoom levels that aren't detailed they're summarised.
+        """
+        blit = pygame.Surface(place.dims(), pygame.SRCALPHA, 32)
+        place.blit_resources(blit, (0, 0), detailed=self._camera.zoom >= self.DETAIL_ZOOM)
+        return blit
+
+    def _rebuild_static_layer(self, places, connections, text_font):
+        """
+            Redraws the connections, outlines, names and connection status of the places in view onto the static layer.
+        """
+        camera = self._camera
+        layer = self._static_layer
+        layer.fill((0, 0, 0, 0))
+        zoom, (ox, oy) = camera.zoom, camera.position
+        width = max(1, round(3 * zoom))
+        # Zoomed out, a few segments of a line are drawn as one in the colour of the first
+        step = max(1, min(8, int(1 / zoom)))
+        for connection in connections:
+            lines = self._connection_segments.get(connection)
+            if lines is None:
+                lines = self._connection_segments[connection] = self._bezier_lines(self._connection_lines[connection][1])
+            for i in range(0, len(lines), step):
+                col, (x0, y0), _ = lines[i]
+                x1, y1 = lines[min(i + step, len(lines)) - 1][2]
+                pygame.draw.line(layer, col, ((x0 - ox) * zoom, (y0 - oy) * zoom), ((x1 - ox) * zoom, (y1 - oy) * zoom), width)
+        for place in places:
+            blit = self._scaled_blit(self._static_blits, place, place.revision[0], place.blit_static)
             if blit:
-                if place == self._selected_place:
-                    blit.fill((0, 120, 240, 20), special_flags=pygame.BLEND_RGB_MULT)
-                txt_blit = text_font.render(place.name, True, (0, 0, 0))
+                px, py = camera.to_screen(*place.position)
+                layer.blit(blit, (px, py))
+                if camera.zoom >= self.LABEL_ZOOM:
+                    txt_blit = text_cache.render(text_font, place.name, True, (0, 0, 0))
+                    x, y = blit.get_size()
+                    x = px + x / 2 - txt_blit.get_width() / 2
+                    y = py + y / 2 - txt_blit.get_height() / 2
+                    layer.blit(txt_blit, (x, y))
+
+    def _redraw_rect(self, rect, text_font, places=None):
+        """
+            Redraws a rectangle of the map's blit from the static layer and the resources and selection of the places in it.
+        """
+        camera = self._camera
+        self._surface.set_clip(rect)
+        self._surface.fill((0, 0, 0, 0))
+        self._surface.blit(self._static_layer, (0, 0))
+
+        if places is None:
+            x, y = camera.to_world(rect.x, rect.y)
+            places = sorted(self._grid.query((x, y, rect.w / camera.zoom, rect.h / camera.zoom)), key=self._place_order.get)
+        for place in places:
+            position = camera.to_screen(*place.position)
+            if place == self._selected_place:
+                blit = self._scaled_blit(self._selected_blits, place, (place.revision, text_font), lambda: self._place_blit(place, text_font))
+                if blit:
+                    self._surface.blit(blit, position)
+            elif camera.zoom == 1:
+                place.blit_resources(self._surface, position)
+            else:
+                self._surface.blit(self._scaled_blit(self._resource_blits, place, place.revision, lambda: self._draw_resources(place)), position)
+        self._surface.set_clip(None)
+
+    def _place_blit(self, place, text_font):
+        """
+            Returns the blit of a place with its name and selection drawn on it, it's only redrawn if the place or the selection has changed.
+        """
+        key = (place.revision, place == self._selected_place, text_font)
+        cached = self._place_blits.get(place)
+        if cached and cached[0] == key:
+            return cached[1]
+
+        blit = place.blit()
+        if blit:
+            blit = blit.copy()
+            if place == self._selected_place:
+                blit.fill((0, 120, 240, 20), special_flags=pygame.BLEND_RGB_MULT)
+            txt_blit = text_cache.render(text_font, place.name, True, (0, 0, 0))
 
-                x, y = blit.get_size()
-                x = x / 2 - txt_blit.get_width() / 2
-                y = y / 2 - txt_blit.get_height() / 2
-                
-                blit.blit(txt_blit, (x, y))
-                surface.blit(blit, place.position)
+            x, y = blit.get_size()
+            x = x / 2 - txt_blit.get_width() / 2
+            y = y / 2 - txt_blit.get_height() / 2
 
-        return surface
+            blit.blit(txt_blit, (x, y))
+        self._place_blits[place] = (key, blit)
+        return blit
 
-    def _draw_bezier(self, surface, pos1, pos2, bend_factor=0.2):
+    def _bezier_curve(self, pos1, pos2, bend_factor=0.2):
         """
-            Returns a pygame.Surface object containing a curved line.
+            Returns the control points of the curved line of a connection and the (x, y, w, h) rectangle that bounds it.
+
+            The curve stays within its control points, so the bounds are known without computing its segments.
         """
         direction = pos2[0] - pos1[0], pos2[1] - pos1[1]
         orth = -direction[1] * bend_factor, direction[0] * bend_factor
         ctrl_point = pos1[0] + direction[0] * 0.5 + orth[0], pos1[1] + direction[1] * 0.5 + orth[1]
-        b_points = compute_bezier_points((pos1, ctrl_point, pos2))
-        length = sum([math.dist(b_points[i], b_points[i + 1]) for i in range(len(b_points) - 1)])  # Evaluate sum of all the "segment" lengths of the bezier curve
-        walked = 0
+        points = (pos1, ctrl_point, pos2)
+        xs, ys = [p[0] for p in points], [p[1] for p in points]
+        x0, y0 = min(xs), min(ys)
+        # Make room for the width of the line
+        bounds = (int(x0) - 3, int(y0) - 3, int(max(xs) - x0) + 7, int(max(ys) - y0) + 7)
+        return points, bounds
 
-        start_col = (255, 0, 0)
-        end_col = (0, 120, 255)
-        for i in range(len(b_points) - 1):
-            walked += math.dist(b_points[i], b_points[i + 1])
-            col = colour_linear_interpolation(start_col, end_col, walked / length)
-            pygame.draw.line(surface, col, b_points[i], b_points[i + 1], 3)
+    def _bezier_lines(self, control_points):
+        """
+            Returns a list of (colour, start, end) line segments of a curved line going from red to blue.
+        """
+        b_points = np.array(compute_bezier_points(control_points))
+
+        # The colour of a segment depends on how far along the curve it ends
+        walked = np.cumsum(np.hypot(*np.diff(b_points, axis=0).T))
+        length = walked[-1] if walked[-1] > 0 else 1
+
+        start_col = np.array((255, 0, 0))
+        end_col = np.array((0, 120, 255))
+        cols = start_col + (end_col - start_col) * (walked / length)[:, None]
+        points = [tuple(p) for p in b_points.tolist()]
+        return [(tuple(col), points[i], points[i + 1]) for i, col in enumerate(cols.tolist())]
 
     def clear(self):
         """
             Clears the map.
         """
         self._places.clear()
+        self._next_id = 0
+        self._place_order.clear()
+        self._grid.clear()
+        self._connection_grid.clear()
+        self._connection_lines.clear()
+        self._connection_segments.clear()
+        self._indexed_connections.clear()
+        self._index_version += 1
+        self._connections_indexed = True
+        self._ready.clear()
+        for blits in (self._place_blits, self._static_blits, self._resource_blits, self._selected_blits):
+            blits.clear()
 
     def json(self):
         """
-            Returns a json object representing the map.
+            Returns a json object representing the map, the places are saved with their stable IDs as their index.
         """
-        for i, p in enumerate(self._places):
-            p.set_index(i)
         places = []
-        for place in self._places:
+        for place in self._places.values():
             p_json = place.json()
             p_json = {k.replace('_',''):v for k, v in p_json.items()}
             places.append(p_json)
@@ -194,15 +563,17 @@ class Map:
         """
             Loads a .json object and replaces the map content.
         """
-        self._places.clear()
+        self.clear()
         index_map = {}
         for place_json in json:
             place = Place.from_json(place_json)
-            self._places.append(place)
+            place.set_scheduler(self._scheduler)
+            self._add_place(place)
             index_map[place_json['index']] = place
 
         for place_json in json:
             place = index_map[place_json['index']]
             for index in place_json['out']:
                 p = index_map[index]
-                place.connect_place(p)
\ No newline at end of file
+                place.connect_place(p)
+        self._connections_indexed = False
\ No newline at end of file
@@ -0,0 +1,70 @@
+import heapq
+import itertools
+import threading
+
+class ReadyQueue:
+    """
+        The places that have to be updated on the next tick, so a tick only costs as much as there is going on.
+
+        Places wake themselves and their neighbours up when something changes for them, or ask to be woken up at a time on the
+        scheduler's clock. Work cycles finish on other threads, so everything is guarded by a lock.
+    """
+    def __init__(self, order):
+        self._order = order     # Place -> its position on the map, places are updated in that order
+        self._lock = threading.Lock()
+        self._ready = set()
+        self._timers = []       # Heap of (time, counter, place)
+        self._counter = itertools.count()
+        self._updates = 0
+
+    def __len__(self):
+        return len(self._ready)
+
+    def stats(self):
+        """
+            Returns a dictionary of counters describing the queue.
+        """
+        with self._lock:
+            return {'ready': len(self._ready), 'timers': len(self._timers), 'updates': self._updates}
+
+    def wake(self, place):
+        """
+            Updates a place on the next tick.
+        """
+        with self._lock:
+            self._ready.add(place)
+
+    def wake_at(self, place, when):
+        """
+            Updates a place on the first tick at or after the time when.
+        """
+        with self._lock:
+            heapq.heappush(self._timers, (when, next(self._counter), place))
+
+    def next_timer(self):
+        """
+            Returns the time of the first place that asked to be woken up later, None if no place did.
+        """
+        with self._lock:
+            return self._timers[0][0] if self._timers else None
+
+    def pop(self, now):
+        """
+            Returns the places to update on a tick at the time now in map order, and empties the queue.
+        """
+        with self._lock:
+            while self._timers and self._timers[0][0] <= now:
+                self._ready.add(heapq.heappop(self._timers)[2])
+            ready, self._ready = self._ready, set()
+        # Places that were removed from the map since they were woken up are left out
+        ready = sorted((place for place in ready if place in self._order), key=self._order.get)
+        self._updates += len(ready)
+        return ready
+
+    def clear(self):
+        """
+            Forgets every place.
+        """
+        with self._lock:
+            self._ready.clear()
+            self._timers.clear()
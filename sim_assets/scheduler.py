@@ -0,0 +1,506 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+_log = logging.getLogger(__name__)
+
+class ScaledClock:
+    """
+        A clock that runs time_scale times as fast as the wall clock, it starts at the wall clock's time.
+    """
+    def __init__(self, time_scale=1):
+        now = time.time()
+        self._state = (now, now, time_scale)    # (time, wall clock time, scale) when the scale was last set, replaced in one go so readers never see half of it
+
+    @property
+    def time_scale(self):
+        return self._state[2]
+
+    def time(self):
+        """
+            Returns the current time of the clock.
+        """
+        start, wall_start, scale = self._state
+        return start + (time.time() - wall_start) * scale
+
+    def set_time_scale(self, time_scale):
+        """
+            Changes how fast the clock runs from now on.
+        """
+        now = time.time()
+        start, wall_start, scale = self._state
+        self._state = (start + (now - wall_start) * scale, now, time_scale)
+
+    def wall_duration(self, duration):
+        """
+            Returns how long a duration on the clock takes on the wall clock.
+        """
+        return duration / self._state[2]
+
+class WorkTracker:
+    """
+        Keeps track of which nodes have a work cycle in progress, so waiting for them to finish doesn't have to poll.
+    """
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._working = {}  # Node -> how many work cycles it has in progress
+
+    def __len__(self):
+        return len(self._working)
+
+    def start(self, node):
+        """
+            Records that a work cycle of a node has started.
+        """
+        with self._condition:
+            self._working[node] = self._working.get(node, 0) + 1
+
+    def finish(self, node):
+        """
+            Records that a work cycle of a node has finished and wakes up anyone waiting for it.
+        """
+        with self._condition:
+            if self._working[node] > 1:
+                self._working[node] -= 1
+            else:
+                del self._working[node]
+            self._condition.notify_all()
+
+    def wait(self, places, timeout=None):
+        """
+            Waits until none of the places has a work cycle in progress, returns False if the timeout ran out first.
+        """
+        with self._condition:
+            pending = [place for place in places if place in self._working]
+            return self._condition.wait_for(lambda: not any(place in self._working for place in pending), timeout)
+
+class ThreadScheduler:
+    """
+        Runs every job in a thread of its own on the wall clock.
+    """
+    virtual = False
+
+    def __init__(self):
+        self._clock = ScaledClock()
+        self._tracker = WorkTracker()
+        self._started = 0
+
+    @property
+    def time_scale(self):
+        return self._clock.time_scale
+
+    def set_time_scale(self, time_scale):
+        """
+            Makes the clock, and so every work cycle and cool-down, run time_scale times as fast as the wall clock.
+        """
+        self._clock.set_time_scale(time_scale)
+
+    def time(self):
+        """
+            Returns the current time of the scheduler's clock.
+        """
+        return self._clock.time()
+
+    def stats(self):
+        """
+            Returns a dictionary of counters describing the scheduler.
+        """
+        return {'threads_started': self._started, 'working': len(self._tracker)}
+
+    def submit(self, node, delay=1):
+        """
+            Starts the work cycle of a node.
+        """
+        self._started += 1
+        self._tracker.start(node)
+        thread = threading.Thread(target=self._run, args=(node, delay))
+        thread.daemon = True
+        thread.start()
+
+    def _run(self, node, delay):
+        """
+            Runs a work cycle to completion, sleeping whenever it asks to wait.
+        """
+        try:
+            for duration in node.work(delay):
+                time.sleep(self._clock.wall_duration(duration))
+        except Exception:
+            _log.exception('Work cycle of %s failed', node.name)
+        finally:
+            self._tracker.finish(node)
+
+    def tick(self, dt):
+        """
+            Advances the scheduler by dt seconds. The wall clock advances by itself so there is nothing to do.
+        """
+        pass
+
+    def wait(self, places, timeout=None):
+        """
+            Waits for all places to finish their current work cycle, returns False if the timeout ran out first.
+        """
+        return self._tracker.wait(places, timeout)
+
+class PoolScheduler:
+    """
+        Runs work cycles on a bounded pool of threads on the wall clock.
+
+        Threads never sleep through a wait, a single timer thread keeps the waiting work cycles in a priority queue and hands each one back to the pool when it is due.
+    """
+    virtual = False
+
+    def __init__(self, max_workers=None):
+        self._max_workers = max_workers if max_workers else min(32, (os.cpu_count() or 1) + 4)
+        self._executor = None   # Started by the first work cycle, so a scheduler that never runs one has no threads
+
+        self._clock = ScaledClock()
+        self._tracker = WorkTracker()
+        self._timers = []       # Heap of (time on the clock, counter, node, work cycle)
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._timer_thread = None
+        self._stopped = False
+
+        # Counters
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._completed = 0
+        self._queued = 0
+        self._peak_queued = 0
+        self._active = 0
+        self._peak_active = 0
+
+    @property
+    def max_workers(self):
+        return self._max_workers
+
+    @property
+    def time_scale(self):
+        return self._clock.time_scale
+
+    def set_time_scale(self, time_scale):
+        """
+            Makes the clock, and so every work cycle and cool-down, run time_scale times as fast as the wall clock.
+        """
+        with self._condition:
+            self._clock.set_time_scale(time_scale)
+            # The timer thread is woken up to work out how long it has to wait at the new scale
+            self._condition.notify()
+
+    def time(self):
+        """
+            Returns the current time of the scheduler's clock.
+        """
+        return self._clock.time()
+
+    def stats(self):
+        """
+            Returns a dictionary of counters describing the scheduler.
+
+            queued is how many steps are waiting for a free thread and saturation is the share of the threads that are busy.
+        """
+        with self._lock:
+            return {
+                'workers': self._max_workers,
+                'submitted': self._submitted,
+                'completed': self._completed,
+                'queued': self._queued,
+                'peak_queued': self._peak_queued,
+                'active': self._active,
+                'peak_active': self._peak_active,
+                'waiting': len(self._timers),
+                'working': len(self._tracker),
+                'saturation': self._active / self._max_workers
+            }
+
+    def submit(self, node, delay=1):
+        """
+            Starts the work cycle of a node.
+        """
+        with self._lock:
+            self._submitted += 1
+        self._tracker.start(node)
+        self._dispatch(node, node.work(delay))
+
+    def _dispatch(self, node, job):
+        """
+            Queues the next step of a work cycle on the pool.
+        """
+        with self._lock:
+            if self._stopped:
+                # The scheduler was shut down, its work cycles are dropped
+                self._tracker.finish(node)
+                return
+            self._queued += 1
+            self._peak_queued = max(self._peak_queued, self._queued)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix='SimSims')
+            self._executor.submit(self._step, node, job)
+
+    def _step(self, node, job):
+        """
+            Runs a work cycle until it asks to wait and hands it to the timer thread.
+        """
+        with self._lock:
+            self._queued -= 1
+            self._active += 1
+            self._peak_active = max(self._peak_active, self._active)
+        try:
+            duration = next(job)
+        except StopIteration:
+            duration = None
+        except Exception:
+            # The pool's future would swallow the error, and the node would be counted as working forever
+            _log.exception('Work cycle of %s failed', node.name)
+            duration = None
+        finally:
+            with self._lock:
+                self._active -= 1
+        if duration is None:
+            with self._lock:
+                self._completed += 1
+            self._tracker.finish(node)
+        else:
+            self._schedule(node, job, self._clock.time() + duration)
+
+    def _schedule(self, node, job, when):
+        """
+            Queues a work cycle to be continued at the time when.
+        """
+        with self._condition:
+            heapq.heappush(self._timers, (when, next(self._counter), node, job))
+            if not self._timer_thread:
+                self._timer_thread = threading.Thread(target=self._run_timers, daemon=True)
+                self._timer_thread.start()
+            self._condition.notify()
+
+    def _run_timers(self):
+        """
+            Hands the waiting work cycles back to the pool as they become due.
+        """
+        while True:
+            with self._condition:
+                while not self._timers and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                when, _, node, job = self._timers[0]
+                remaining = when - self._clock.time()
+                if remaining > 0:
+                    self._condition.wait(self._clock.wall_duration(remaining))
+                    continue
+                heapq.heappop(self._timers)
+            self._dispatch(node, job)
+
+    def tick(self, dt):
+        """
+            Advances the scheduler by dt seconds. The wall clock advances by itself so there is nothing to do.
+        """
+        pass
+
+    def wait(self, places, timeout=None):
+        """
+            Waits for all places to finish their current work cycle, returns False if the timeout ran out first.
+        """
+        return self._tracker.wait(places, timeout)
+
+    def shutdown(self):
+        """
+            Waits for the running steps and stops the threads of the pool and the timer thread, waiting work cycles are dropped.
+        """
+        with self._condition, self._lock:
+            self._stopped = True
+            executor, self._executor = self._executor, None
+            self._condition.notify()
+        if executor:
+            executor.shutdown(wait=True)
+
+class AsyncioScheduler:
+    """
+        Runs every work cycle as a coroutine on an asyncio event loop in the thread that drives it.
+
+        The loop only runs when tick is called, which the main loop does once per frame, so all work happens on one thread without any lock contention.
+    """
+    virtual = False
+
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._clock = ScaledClock()
+        self._tasks = set()
+        self._submitted = 0
+        self._completed = 0
+
+    @property
+    def time_scale(self):
+        return self._clock.time_scale
+
+    def set_time_scale(self, time_scale):
+        """
+            Makes the clock, and so every work cycle and cool-down, run time_scale times as fast as the wall clock.
+        """
+        self._clock.set_time_scale(time_scale)
+
+    def time(self):
+        """
+            Returns the current time of the scheduler's clock.
+        """
+        return self._clock.time()
+
+    def stats(self):
+        """
+            Returns a dictionary of counters describing the scheduler.
+        """
+        return {
+            'submitted': self._submitted,
+            'completed': self._completed,
+            'tasks': len(self._tasks)
+        }
+
+    def submit(self, node, delay=1):
+        """
+            Starts the work cycle of a node as a task on the event loop.
+        """
+        self._submitted += 1
+        task = self._loop.create_task(self._run(node, delay))
+        self._tasks.add(task)
+        task.add_done_callback(self._done)
+
+    async def _run(self, node, delay):
+        """
+            Coroutine that runs a work cycle to completion.
+        """
+        try:
+            for duration in node.work(delay):
+                await asyncio.sleep(self._clock.wall_duration(duration))
+        except Exception:
+            # The task's exception would only be reported once it's garbage collected
+            _log.exception('Work cycle of %s failed', node.name)
+
+    def _done(self, task):
+        self._tasks.discard(task)
+        self._completed += 1
+
+    def tick(self, dt):
+        """
+            Runs one iteration of the event loop, continuing every coroutine that is due.
+        """
+        self._loop.call_soon(self._loop.stop)
+        self._loop.run_forever()
+
+    def wait(self, places, timeout=None):
+        """
+            Runs the event loop until every work cycle has finished, returns False if the timeout ran out first.
+        """
+        if not self._tasks:
+            return True
+        _, pending = self._loop.run_until_complete(asyncio.wait(list(self._tasks), timeout=timeout))
+        return not pending
+
+class EventScheduler:
+    """
+        A discrete-event scheduler.
+
+        Work cycles are kept in a priority queue ordered by the virtual time of their next step, so time only passes when the scheduler is told to advance it.
+    """
+    virtual = True
+
+    def __init__(self, start=0):
+        self._now = start
+        self._time_scale = 1
+        self._queue = []
+        self._counter = itertools.count()  # Breaks ties between steps that are due at the same time in submission order
+
+    @property
+    def time_scale(self):
+        return self._time_scale
+
+    def set_time_scale(self, time_scale):
+        """
+            Makes every tick advance the virtual clock time_scale times as far.
+        """
+        self._time_scale = time_scale
+
+    def stats(self):
+        """
+            Returns a dictionary of counters describing the scheduler.
+        """
+        return {'pending': len(self._queue)}
+
+    def time(self):
+        """
+            Returns the current time of the virtual clock.
+        """
+        return self._now
+
+    def submit(self, node, delay=1):
+        """
+            Starts the work cycle of a node at the current virtual time.
+        """
+        self._step(node.work(delay))
+
+    def _step(self, job):
+        """
+            Runs a work cycle until it asks to wait and queues it for when the wait is over.
+        """
+        try:
+            duration = next(job)
+        except StopIteration:
+            return
+        heapq.heappush(self._queue, (self._now + duration, next(self._counter), job))
+
+    def next_event(self):
+        """
+            Returns the virtual time of the next queued step, None if nothing is queued.
+        """
+        if self._queue:
+            return self._queue[0][0]
+        return None
+
+    def run_until(self, t):
+        """
+            Runs every step that is due at or before the virtual time t and moves the clock to t.
+        """
+        while self._queue and self._queue[0][0] <= t:
+            when, _, job = heapq.heappop(self._queue)
+            self._now = max(self._now, when)
+            self._step(job)
+        self._now = max(self._now, t)
+
+    def tick(self, dt):
+        """
+            Advances the virtual clock by dt seconds times the time scale.
+        """
+        self.run_until(self._now + dt * self._time_scale)
+
+    def wait(self, places, timeout=None):
+        """
+            Finishes every queued work cycle by advancing the clock past their last step, the clock is virtual so it never times out.
+        """
+        while self._queue:
+            self.run_until(self._queue[0][0])
+        return True
+
+_default_scheduler = None
+_default_lock = threading.Lock()
+
+def default_scheduler():
+    """
+        Returns the scheduler of places that weren't given one, it's only made once a place asks for it.
+    """
+    global _default_scheduler
+    with _default_lock:
+        if _default_scheduler is None:
+            _default_scheduler = PoolScheduler()
+        return _default_scheduler
+
+SCHEDULERS = {
+    'thread': ThreadScheduler,
+    'pool': PoolScheduler,
+    'asyncio': AsyncioScheduler,
+    'event': EventScheduler
+}
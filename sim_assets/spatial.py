@@ -0,0 +1,66 @@
+import math
+
+class SpatialGrid:
+    """
+        A uniform grid spatial index. Every cell holds the items whose bounding rectangle overlaps it.
+    """
+    def __init__(self, cell_size=128):
+        self._cell_size = cell_size
+        self._cells = {}        # (column, row) -> the items in it, a dictionary used as an ordered set so they're removed in constant time
+        self._item_cells = {}   # item -> list of the (column, row) cells it is in
+
+    def __len__(self):
+        return len(self._item_cells)
+
+    def _cell_range(self, rect):
+        """
+            Returns the cells that a (x, y, w, h) rectangle overlaps.
+        """
+        x, y, w, h = rect
+        c0, r0 = math.floor(x / self._cell_size), math.floor(y / self._cell_size)
+        c1, r1 = math.floor((x + w) / self._cell_size), math.floor((y + h) / self._cell_size)
+        return [(c, r) for c in range(c0, c1 + 1) for r in range(r0, r1 + 1)]
+
+    def insert(self, item, rect):
+        """
+            Adds an item with a (x, y, w, h) bounding rectangle, an item that is already in the grid is moved.
+        """
+        if item in self._item_cells:
+            self.remove(item)
+        cells = self._cell_range(rect)
+        for cell in cells:
+            self._cells.setdefault(cell, {})[item] = None
+        self._item_cells[item] = cells
+
+    def remove(self, item):
+        """
+            Removes an item from the grid.
+        """
+        for cell in self._item_cells.pop(item, ()):
+            items = self._cells[cell]
+            del items[item]
+            if not items:
+                del self._cells[cell]
+
+    def clear(self):
+        """
+            Removes every item from the grid.
+        """
+        self._cells.clear()
+        self._item_cells.clear()
+
+    def at(self, x, y):
+        """
+            Returns the items whose cell contains the point (x, y), they aren't necessarily at the point themselves.
+        """
+        cell = (math.floor(x / self._cell_size), math.floor(y / self._cell_size))
+        return self._cells.get(cell, {}).keys()
+
+    def query(self, rect):
+        """
+            Returns a set of the items in the cells that a (x, y, w, h) rectangle overlaps.
+        """
+        found = set()
+        for cell in self._cell_range(rect):
+            found.update(self._cells.get(cell, ()))
+        return found
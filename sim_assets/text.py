@@ -0,0 +1,47 @@
+from collections import OrderedDict
+
+class TextCache:
+    """
+        A least-recently-used cache of rendered text, keyed by (font, text, colour, antialias).
+
+        The blits are shared between everyone rendering the same text, so they shouldn't be drawn on.
+    """
+    def __init__(self, max_size=512):
+        self._max_size = max_size
+        self._blits = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    def __len__(self):
+        return len(self._blits)
+
+    def render(self, font, text, antialias, colour):
+        """
+            Returns a blit of the text, the same as font.render but only rendered the first time.
+        """
+        key = (font, text, tuple(colour), antialias)
+        blit = self._blits.get(key)
+        if blit is None:
+            self._misses += 1
+            blit = font.render(text, antialias, colour)
+            self._blits[key] = blit
+            if len(self._blits) > self._max_size:
+                self._blits.popitem(last=False)
+        else:
+            self._hits += 1
+            self._blits.move_to_end(key)
+        return blit
+
+    def stats(self):
+        """
+            Returns a dictionary of counters describing the cache.
+        """
+        return {'size': len(self._blits), 'hits': self._hits, 'misses': self._misses}
+
+    def clear(self):
+        """
+            Empties the cache.
+        """
+        self._blits.clear()
+
+text_cache = TextCache()
@@ -1,4 +1,5 @@
 import pygame
+from .text import text_cache
 class UI:
     def __init__(self):
         self._buttons = []
@@ -55,28 +56,11 @@ class Button:
         self._text = text
         self._func = func
         self._args = arg
-        # Create the text blit of the button
-        txt_blit = font.render(text, text_aa, text_colour)
-        txt_dims = (txt_blit.get_width(), txt_blit.get_height())
-
-        # IF we want to expand, check if the text is bigger than the given dimensions
-        if not expand:
-            self._dims = dims
-        else:
-            self._dims = (max(txt_dims[0], dims[0]) + padx, max(txt_dims[1], dims[1]) + pady)
-
-        # Create the final surface and apply the background colour and border
-        blit = pygame.Surface(self._dims, pygame.SRCALPHA, 32).convert_alpha()
-        blit.fill(background_colour)
-        if border_width > 0:
-            pygame.draw.rect(blit, border_colour, pygame.Rect(0, 0, self._dims[0], self._dims[1]), border_width)
-
-        # Blit the text to it
-        blit.blit(txt_blit, (self._dims[0] / 2 - txt_dims[0] / 2, self._dims[1] / 2 - txt_dims[1] / 2))
-
-        self._blit = blit
+        self._style = (font, dims, text_aa, text_colour, background_colour, border_colour, border_width, expand, padx, pady)
+        self._centered = centered
+        self._render()
         if centered:
-            self._position = (position[0] - blit.get_width() / 2, position[1] - blit.get_height() / 2)
+            self._position = (position[0] - self._dims[0] / 2, position[1] - self._dims[1] / 2)
         else:
             self._position = position
         self._hidden = False
@@ -102,6 +86,43 @@ class Button:
     def dims(self):
         return self._dims
 
+    def _render(self):
+        """
+            Renders the blit of the button with its current text.
+        """
+        font, dims, text_aa, text_colour, background_colour, border_colour, border_width, expand, padx, pady = self._style
+        # Create the text blit of the button
+        txt_blit = font.render(self._text, text_aa, text_colour)
+        txt_dims = (txt_blit.get_width(), txt_blit.get_height())
+
+        # IF we want to expand, check if the text is bigger than the given dimensions
+        if not expand:
+            self._dims = dims
+        else:
+            self._dims = (max(txt_dims[0], dims[0]) + padx, max(txt_dims[1], dims[1]) + pady)
+
+        # Create the final surface and apply the background colour and border
+        blit = pygame.Surface(self._dims, pygame.SRCALPHA, 32).convert_alpha()
+        blit.fill(background_colour)
+        if border_width > 0:
+            pygame.draw.rect(blit, border_colour, pygame.Rect(0, 0, self._dims[0], self._dims[1]), border_width)
+
+        # Blit the text to it
+        blit.blit(txt_blit, (self._dims[0] / 2 - txt_dims[0] / 2, self._dims[1] / 2 - txt_dims[1] / 2))
+        self._blit = blit
+
+    def set_text(self, text):
+        """
+            Changes the text of the button, a centered button stays centered on the same point.
+        """
+        if text == self._text:
+            return
+        (x, y), (w, h) = self._position, self._dims
+        self._text = text
+        self._render()
+        if self._centered:
+            self._position = (x + w / 2 - self._dims[0] / 2, y + h / 2 - self._dims[1] / 2)
+
     def move(self, dx, dy):
         """
             Moves the button in both axis.
@@ -198,7 +219,7 @@ class Panel:
         """
             Adds text as content.
         """
-        blit = font.render(text, True, colour)
+        blit = text_cache.render(font, text, True, colour)
         self._content.append(self.PanelContent(self._content_offset, self.next_y(), text, blit))
         self._redraw()
 
@@ -1,26 +1,53 @@
-import pygame
-import threading
+try:
+    import pygame
+except ImportError:  # Headless simulations don't need pygame
+    pygame = None
 import math
 import time
 import random
-from .ext import map_from_to, colour_linear_interpolation, compute_bezier_points
+from collections import deque
+from itertools import repeat, count, islice
+import numpy as np
+from .ext import map_from_to, colour_linear_interpolation, compute_bezier_points, ring_layout
+from .scheduler import default_scheduler
+from .text import text_cache
+from .locks import CountedLock, ordered_locks
 # RESOURCES
 
+# Every change of a ResourceBuckets gets a revision from here, so revisions are unique across all places
+_REVISIONS = count()
+
 class Resource:
+    """
+        Base class of all resources.
+
+        Resources without any state of their own are flyweights, there is only ever one instance of each such type.
+    """
+    __slots__ = ()
+    STATELESS = True
+    _name = 'Resource'
+    _colour = (0, 0, 0)
+    _dims = (8, 8)
+    def __new__(cls, *args, **kwargs):
+        if cls.STATELESS:
+            instance = cls.__dict__.get('_instance')
+            if instance is None:
+                instance = super().__new__(cls)
+                cls._instance = instance
+            return instance
+        return super().__new__(cls)
     def __init__(self, *args, **kwargs):
-        self._name = kwargs.get('name', 'Resource')
-        self._colour = kwargs.get('colour', (0, 0, 0))
-        self._dims = kwargs.get('dims', (8, 8))
+        pass
     @property
     def name(self):
         return self._name
     def blit(self):
         """
             Returns a blit which is coloured based on the sub-classe's choice of colour.
+
+            The blit is a part of the resource atlas shared by every resource of the type, so it shouldn't be drawn on.
         """
-        surface = pygame.Surface(self._dims)
-        surface.fill(self._colour)
-        return surface
+        return RESOURCE_ATLAS.sprite(type(self))
 
     def json(self):
         """
@@ -29,10 +56,9 @@ class Resource:
         json = {
             'type':self.__class__.__name__
         }
-        json = {**json, **self.__dict__}
-        json = {k.replace('_', ''): v for k, v in json.items()}
-        for k in ('name', 'colour', 'dims'):
-            json.pop(k, None)
+        for cls in type(self).__mro__:
+            for k in getattr(cls, '__slots__', ()):
+                json[k.replace('_', '')] = getattr(self, k)
         return json
 
     @staticmethod
@@ -48,10 +74,11 @@ class Worker(Resource):
     """
         Worker class, indicated with the colour black.
     """
+    __slots__ = ('_viability', )
+    STATELESS = False
+    _name = 'Worker'
+    _colour = (0, 0, 0)
     def __init__(self, *args, **kwargs):
-        kwargs['colour'] = 0, 0, 0
-        kwargs['name'] = self.__class__.__name__
-        super().__init__(*args, **kwargs)
         self._viability = kwargs.get('viability', 1)
 
     @property
@@ -83,44 +110,233 @@ class Food(Resource):
     """
         Food class, indicated with the colour Green.
     """
-    def __init__(self, *args, **kwargs):
-        kwargs['colour'] = 0, 255, 0
-        kwargs['name'] = self.__class__.__name__
-        super().__init__(*args, **kwargs)
+    __slots__ = ()
+    _name = 'Food'
+    _colour = (0, 255, 0)
 
 class Product(Resource):
     """
         Product class, indicated with the colour Red.
     """
-    def __init__(self, *args, **kwargs):
-        kwargs['colour'] = 255, 0, 0
-        kwargs['name'] = self.__class__.__name__
-        super().__init__(*args, **kwargs)
+    __slots__ = ()
+    _name = 'Product'
+    _colour = (255, 0, 0)
+
+class ResourceAtlas:
+    """
+        Every resource sprite rendered once, side by side on one shared surface.
+
+        Drawing many resources is then a single Surface.blits call with an area of the atlas per resource.
+    """
+    def __init__(self):
+        self._surface = None
+        self._areas = {}
+        self._sprites = {}
+
+    def _build(self):
+        """
+            Renders the sprite of every resource type onto a new atlas.
+        """
+        types = Resource.__subclasses__()
+        width = sum(t._dims[0] for t in types)
+        height = max(t._dims[1] for t in types)
+        self._surface = pygame.Surface((width, height))
+        self._areas.clear()
+        self._sprites.clear()
+        x = 0
+        for t in types:
+            area = pygame.Rect((x, 0), t._dims)
+            self._surface.fill(t._colour, area)
+            self._areas[t] = area
+            self._sprites[t] = self._surface.subsurface(area)
+            x += area.width
+
+    @property
+    def surface(self):
+        if self._surface is None:
+            self._build()
+        return self._surface
+
+    def area(self, t):
+        """
+            Returns the rectangle of the atlas holding the sprite of a resource type.
+        """
+        area = self._areas.get(t)
+        if area is None:
+            self._build()
+            area = self._areas[t]
+        return area
+
+    def sprite(self, t):
+        """
+            Returns the sprite of a resource type as a subsurface of the atlas.
+        """
+        self.area(t)
+        return self._sprites[t]
+
+RESOURCE_ATLAS = ResourceAtlas()
+
+class ResourceBuckets:
+    """
+        Holds the resources of a place in one bucket per resource type, so counting and taking a resource of a type is O(1).
+
+        Stateless resources are flyweights so their bucket is just a count, other resources are kept in a deque.
+        Iterating goes through the resources type by type, in the order each type was first added.
+    """
+    def __init__(self, resources=()):
+        self._buckets = {}
+        self._size = 0
+        self._revision = next(_REVISIONS)
+        for r in resources:
+            self.append(r)
+
+    @property
+    def revision(self):
+        return self._revision
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        for t, bucket in list(self._buckets.items()):
+            if t.STATELESS:
+                yield from repeat(t(), bucket)
+            else:
+                yield from list(bucket)
+
+    def types(self):
+        """
+            Returns a list of the types that there are any resources of.
+        """
+        return [t for t, bucket in self._buckets.items() if bucket]
+
+    def of_type(self, t):
+        """
+            Returns a list of the resources of a type.
+        """
+        bucket = self._buckets.get(t)
+        if not bucket:
+            return []
+        if t.STATELESS:
+            return [t()] * bucket
+        return list(bucket)
+
+    def head(self, t, n):
+        """
+            Returns a list of at most n resources of a type, the ones that were added first.
+        """
+        bucket = self._buckets.get(t)
+        if not bucket:
+            return []
+        if t.STATELESS:
+            return [t()] * min(n, bucket)
+        return list(islice(bucket, n))
+
+    def count(self, t):
+        """
+            Returns how many resources there are of a type.
+        """
+        bucket = self._buckets.get(t)
+        if not bucket:
+            return 0
+        return bucket if t.STATELESS else len(bucket)
+
+    def first(self, t):
+        """
+            Returns the resource of a type that was added first, None if there is none.
+        """
+        bucket = self._buckets.get(t)
+        if not bucket:
+            return None
+        return t() if t.STATELESS else bucket[0]
+
+    def append(self, r):
+        """
+            Adds a resource.
+        """
+        t = type(r)
+        if t.STATELESS:
+            self.add_count(t, 1)
+            return
+        bucket = self._buckets.get(t)
+        if bucket is None:
+            bucket = self._buckets[t] = deque()
+        bucket.append(r)
+        self._size += 1
+        self._revision = next(_REVISIONS)
+
+    def add_count(self, t, count):
+        """
+            Adds count resources of a stateless type.
+        """
+        self._buckets[t] = self._buckets.get(t, 0) + count
+        self._size += count
+        self._revision = next(_REVISIONS)
+
+    def pop(self, t):
+        """
+            Removes and returns the resource of a type that was added first, None if there is none.
+        """
+        bucket = self._buckets.get(t)
+        if not bucket:
+            return None
+        self._size -= 1
+        self._revision = next(_REVISIONS)
+        if t.STATELESS:
+            self._buckets[t] -= 1
+            return t()
+        return bucket.popleft()
+
+    def remove(self, r):
+        """
+            Removes a specific resource.
+        """
+        t = type(r)
+        if t.STATELESS:
+            self._buckets[t] -= 1
+        else:
+            self._buckets[t].remove(r)
+        self._size -= 1
+        self._revision = next(_REVISIONS)
+
+    def remove_all(self, t):
+        """
+            Removes every resource of a type.
+        """
+        self._size -= self.count(t)
+        if t in self._buckets:
+            self._buckets[t] = 0 if t.STATELESS else deque()
+        self._revision = next(_REVISIONS)
 
 class Place:
-    PLACE_COUNTER = 0
+    SUMMARY_SAMPLE = 256    # How many workers the viability histogram of a summary looks at
+    SUMMARY_BINS = 5
+    _summary_font = None
     def __init__(self, name, uses, produces, *args, **kwargs):
         self._name = name
-        self._resources = []
-        self._ingoing_connections = []
-        self._outgoing_connections = []
+        self._resources = ResourceBuckets()
+        self._ingoing_connections = {}  # Places used as an ordered set, in the order they were connected
+        self._outgoing_connections = {}
         self._position = kwargs.get('position', (0, 0))
         self._working = False
         self._uses = uses
         self._produces = produces
+        self._scheduler = kwargs.get('scheduler') or default_scheduler()
+        self._ready_queue = None    # Where the place wakes itself and its neighbours up, set by the map it's on
+        self._suppliers = {}        # Resource type -> the ingoing places it's fetched from
+        self._consumers = {}        # Resource type -> the outgoing places it's delivered to
+        self._has_required = None   # Cached has_required_connections, None when the connections changed since
+        self._thread_lock = CountedLock()   # Guards the resources and routing tables, transfers take the locks of both places through ordered_locks
 
-        if kwargs.get('index', 0):
-            self._index = kwargs.get('index')
-        elif kwargs.get('set_index', True):
-            self._index = Place.PLACE_COUNTER
-            Place.PLACE_COUNTER += 1
-        else:
-            self._index = -1
+        self._index = kwargs.get('index', -1)  # The stable ID the map the place is on knows it by, -1 if it isn't on one
 
         # Graphics
         self._background = kwargs.get('background', (255, 255, 255))
         self._border = kwargs.get('border', (0, 0, 0))
         self._dims = kwargs.get('dims', (90, 90))
+        self._revision = 0          # Increased whenever the look of the place changes
+        self._blit_cache = None     # A (revision, blit) pair of the last rendered blit
+        self._static_cache = None   # A (revision, blit) pair of the last rendered blit without resources
 
     @property
     def name(self):
@@ -134,9 +350,62 @@ class Place:
     @property
     def working(self):
         return self._working
+    @property
+    def ingoing_connections(self):
+        """
+            A read-only view of the places connected to this one, in the order they were connected.
+        """
+        return self._ingoing_connections.keys()
+    @property
+    def outgoing_connections(self):
+        """
+            A read-only view of the places this one is connected to, in the order they were connected.
+        """
+        return self._outgoing_connections.keys()
+    @property
+    def lock(self):
+        return self._thread_lock
+    @property
+    def revision(self):
+        """
+            Changes whenever the place or its resources change, the cached blit is redrawn when it does.
+        """
+        return self._revision, self._resources.revision
+
+    def _mark_dirty(self):
+        """
+            Marks the cached blit as outdated.
+        """
+        self._revision += 1
 
     def set_index(self, i):
         self._index = i
+
+    def set_scheduler(self, scheduler):
+        """
+            Sets the scheduler that keeps the time and runs the work of this place.
+        """
+        self._scheduler = scheduler
+
+    def set_ready_queue(self, ready_queue):
+        """
+            Sets the ready queue that decides when the place is updated, without one it's only updated when called directly.
+        """
+        self._ready_queue = ready_queue
+
+    def wake(self):
+        """
+            Updates the place on the next tick.
+        """
+        if self._ready_queue is not None:
+            self._ready_queue.wake(self)
+
+    def wake_at(self, when):
+        """
+            Updates the place on the first tick at or after the time when on the scheduler's clock.
+        """
+        if self._ready_queue is not None:
+            self._ready_queue.wake_at(self, when)
     
     def uses(self, t):
         """
@@ -152,9 +421,62 @@ class Place:
             return t in self._produces
         return False
 
+    def _routes_to(self, place):
+        """
+            Returns a boolean if resources move between this place and a connected place, it's a virtual method.
+        """
+        return False
+
+    def _add_route(self, place, ingoing):
+        """
+            Adds a connected place to the tables of where every resource type is fetched from and delivered to,
+            so moving resources doesn't have to search the connections.
+        """
+        if not self._routes_to(place):
+            return
+        if ingoing:
+            for t in self._uses:
+                if place.produces(t):
+                    self._suppliers.setdefault(t, {})[place] = None
+        else:
+            for t in self._produces or ():
+                if place.uses(t):
+                    self._consumers.setdefault(t, {})[place] = None
+
+    def _routed(self, table):
+        """
+            Returns a list of every place in one of the routing tables. The tables are changed under the lock of the place,
+            and connections can change on another thread, so they're only read from a copy like this one.
+        """
+        with self._thread_lock:
+            return [place for places in table.values() for place in places]
+
+    def _remove_route(self, place):
+        """
+            Removes a place from the tables of where resources are fetched from and delivered to.
+        """
+        for table in (self._suppliers, self._consumers):
+            for places in table.values():
+                places.pop(place, None)
+
+    def _connections_changed(self):
+        """
+            Brings everything that depends on the connections of the place up to date, it's called whenever one is added or removed.
+        """
+        self._mark_dirty()
+        self._has_required = None
+
     def has_required_connections(self):
         """
-            Returns a boolean if this place has the required connections to operate properly.
+            Returns a boolean if this place has the required connections to operate properly. It's cached until the connections change.
+        """
+        if self._has_required is None:
+            self._has_required = self._check_required_connections()
+        return self._has_required
+
+    def _check_required_connections(self):
+        """
+            Returns a boolean if every type the place uses comes from an ingoing connection and every type it produces goes to an outgoing one.
         """
         for t in self._uses:
             uses = False
@@ -195,7 +517,106 @@ class Place:
 
     def blit(self):
         """
-            Returns a blit of the object.
+            Returns a blit of the object. It's cached until the place changes, so it's shared and shouldn't be drawn on.
+        """
+        revision = self.revision
+        if not self._blit_cache or self._blit_cache[0] != revision:
+            self._blit_cache = (revision, self._draw())
+        return self._blit_cache[1]
+
+    def blit_static(self):
+        """
+            Returns a blit of the object without its resources. It only changes with the connections of the place and is cached like blit.
+        """
+        if not self._static_cache or self._static_cache[0] != self._revision:
+            self._static_cache = (self._revision, self._draw_static())
+        return self._static_cache[1]
+
+    def resource_capacity(self):
+        """
+            Returns how many resources fit on the object's blit, it's a virtual method.
+        """
+        return 0
+
+    def blit_resources(self, surface, position, detailed=True):
+        """
+            Draws the resources of the object onto a surface with the object at a position.
+
+            If there are more than fit, or detailed is False, a summary is drawn instead, so the cost doesn't grow with the amount of resources.
+        """
+        with self._thread_lock:
+            if not self._resources:
+                return
+            if detailed and len(self._resources) <= self.resource_capacity():
+                self._blit_resource_sprites(surface, position)
+            else:
+                self._blit_resource_summary(surface, position)
+
+    def _blit_resource_sprites(self, surface, position):
+        """
+            Draws every resource of the object, it's a virtual method.
+        """
+        pass
+
+    def _summary_box(self):
+        """
+            Returns the (x, y, w, h) box of the object's blit that its summary is drawn in.
+        """
+        return (4, 4, self._dims[0] - 8, self._dims[1] - 8)
+
+    def _blit_resource_summary(self, surface, position):
+        """
+            Draws a row with the sprite and count of each resource type, and a histogram of the viability of the workers below them.
+        """
+        if Place._summary_font is None:
+            pygame.font.init()
+            Place._summary_font = pygame.font.Font(None, 16)
+        font = Place._summary_font
+        bx, by, bw, bh = self._summary_box()
+        bx, by = bx + position[0], by + position[1]
+        types = self._resources.types()
+
+        histogram_height = min(16, bh // 4) if Worker in types else 0
+        row_height = font.get_linesize()
+        bottom = by + bh - histogram_height
+        y = by
+        blits = []
+        for t in types:
+            if y + row_height > bottom:
+                break
+            area = RESOURCE_ATLAS.area(t)
+            text = text_cache.render(font, str(self._resources.count(t)), True, (0, 0, 0))
+            blits.append((RESOURCE_ATLAS.surface, (bx, y + (row_height - area.height) // 2), area))
+            blits.append((text, (bx + area.width + 4, y)))
+            y += row_height
+        surface.blits(blits, doreturn=False)
+
+        if histogram_height:
+            # Only a bounded sample of the workers is looked at, the histogram is an impression rather than an exact count
+            viabilities = [w.viability for w in self._resources.head(Worker, self.SUMMARY_SAMPLE)]
+            counts = np.histogram(np.clip(viabilities, 0, 1), bins=self.SUMMARY_BINS, range=(0, 1))[0]
+            bin_width = bw / self.SUMMARY_BINS
+            for i, c in enumerate(counts):
+                height = round(histogram_height * c / counts.max())
+                if height:
+                    colour = colour_linear_interpolation((200, 0, 0), (0, 200, 0), (i + 0.5) / self.SUMMARY_BINS)
+                    rect = pygame.Rect(bx + round(i * bin_width), by + bh - height, max(1, round(bin_width) - 1), height)
+                    pygame.draw.rect(surface, colour, rect)
+
+    def _draw(self):
+        """
+            Draws a new blit of the object, its static blit with the resources on top.
+        """
+        static = self.blit_static()
+        if not static:
+            return None
+        surface = static.copy()
+        self.blit_resources(surface, (0, 0))
+        return surface
+
+    def _draw_static(self):
+        """
+            Draws a new blit of the object without its resources, it's a virtual method.
         """
         return None
 
@@ -212,6 +633,20 @@ class Place:
         return pairs
 
     ## SimSims
+    def resource_counts(self):
+        """
+            Returns a dictionary of how many resources of each type the place has.
+        """
+        with self._thread_lock:
+            return {t: self._resources.count(t) for t in self._resources.types()}
+
+    def worker_viabilities(self):
+        """
+            Returns a list of the viabilities of the workers in the place, in the order they were added.
+        """
+        with self._thread_lock:
+            return [w.viability for w in self._resources.of_type(Worker)]
+
     def _count_resources(self, types):
         """
             Counts each resource in types. Types can be of type Resource or a list of Resource types.
@@ -223,7 +658,7 @@ class Place:
         if isinstance(types, (list, tuple)):
             ret = []
             for t in types:
-                ret.append(sum([isinstance(o, t) for o in self._resources]))
+                ret.append(self._resources.count(t))
             return ret
         return self._count_resources([types])
 
@@ -235,38 +670,54 @@ class Place:
             return
         self.connect_outgoing(place)
         place.connect_ingoing(self)
+        self.wake()
+        place.wake()
 
     def connect_ingoing(self, place):
         """
             Adds a place to the ingoing connections.
         """ 
         if not place in self._ingoing_connections:
-            self._ingoing_connections.append(place)
+            self._ingoing_connections[place] = None
+            with self._thread_lock:
+                self._add_route(place, True)
+            self._connections_changed()
 
     def connect_outgoing(self, place):
         """
             Adds a place to the outgoing connections.
         """ 
         if not place in self._outgoing_connections:
-            self._outgoing_connections.append(place)
+            self._outgoing_connections[place] = None
+            with self._thread_lock:
+                self._add_route(place, False)
+            self._connections_changed()
 
     def disconnect_place(self, place):
         """
             Fully disconnects this place from another place.
         """
-        if place in self._ingoing_connections:
-            self._ingoing_connections.remove(place)
-            place.disconnect_place(self)
-        if place in self._outgoing_connections:
-            self._outgoing_connections.remove(place)
-            place.disconnect_place(self)
+        if place in self._ingoing_connections or place in self._outgoing_connections:
+            self._drop_connection(place)
+            place._drop_connection(self)
+
+    def _drop_connection(self, place):
+        """
+            Removes a place from the connections of this place in both directions, without touching the other place.
+        """
+        self._ingoing_connections.pop(place, None)
+        self._outgoing_connections.pop(place, None)
+        with self._thread_lock:
+            self._remove_route(place)
+        self._connections_changed()
+        self.wake()
 
     def disconnect_all_connections(self):
         """
             Fully disconnects this place from all places it is connected to, both ingoing and outgoing connections.
         """
-        for place in self._ingoing_connections[:] + self._outgoing_connections[:]:
-            place.disconnect_place(self)
+        for place in [*self._ingoing_connections, *self._outgoing_connections]:
+            self.disconnect_place(place)
 
     def insert(self, r: Resource):
         """
@@ -286,7 +737,9 @@ class Place:
         """
         index_in_connections = [c.index for c in self._ingoing_connections]
         index_ou_connections = [c.index for c in self._outgoing_connections]
-        resource_count = [r.json() for r in self._resources]
+        with self._thread_lock:
+            resources = list(self._resources)
+        resource_count = [r.json() for r in resources]
         json = {
             'type': self.__class__.__name__,
             'in': index_in_connections,
@@ -294,7 +747,8 @@ class Place:
             'resources': resource_count
         }
         _dict = self.__dict__.copy()
-        for k in ('_ingoing_connections', '_outgoing_connections', '_resources', '_thread_lock', '_produces', '_uses', '_name'):
+        for k in ('_ingoing_connections', '_outgoing_connections', '_resources', '_thread_lock', '_produces', '_uses', '_name', '_scheduler', '_revision', '_blit_cache', '_static_cache',
+                  '_ready_queue', '_notified_revision', '_suppliers', '_consumers', '_has_required'):
             _dict.pop(k, None)
         json = {**json, **_dict}  # Merges the two dictionaries
         return json
@@ -313,6 +767,8 @@ class Place:
 #       NODES
 ####################
 class Node(Place):
+    WORK_DELAY = 1
+    COOL_DOWN = 0.2
     def __init__(self, name, uses, produces, *args, **kwargs):
         super().__init__(name, uses, produces, *args, **kwargs)
         self._has_waiting_resources = kwargs.get('haswaitingresources', False)
@@ -322,7 +778,7 @@ class Node(Place):
     def waiting_resources(self):
         return self._has_waiting_resources
 
-    def blit(self):
+    def _draw_static(self):
         # Create a surface
         surface = pygame.Surface(self._dims, pygame.SRCALPHA).convert_alpha()
         surface.fill(self._background)
@@ -334,13 +790,23 @@ class Node(Place):
         x, y = self._dims[0] // 2, self._dims[1] // 2
         has_connections_colour = (0, 200, 0) if self.has_required_connections() else (200, 0, 0)
         pygame.draw.circle(surface, has_connections_colour, (x, y), x // 2, 0)
+        return surface
 
+    def resource_capacity(self):
+        # The grid has a column or row for every sprite and offset that fit, the last sprite doesn't need an offset
+        w, h = Resource._dims
+        return ((self._dims[0] - w) // (w + 5) + 1) * ((self._dims[1] - h) // (h + 5) + 1)
+
+    def _blit_resource_sprites(self, surface, position):
         # Simply render them in a grid-like manner starting from the top-left
+        px, py = position
         offset = 5
         x, y = 0, 0
+        atlas = RESOURCE_ATLAS.surface
+        blits = []
         for resource in self._resources:
-            blit = resource.blit()
-            w, h = blit.get_size()
+            area = RESOURCE_ATLAS.area(type(resource))
+            w, h = area.size
             # If we reach the right edge, increase y and reset x
             if x + w > self._dims[0]:
                 y += h + offset
@@ -348,9 +814,9 @@ class Node(Place):
             # If we reach the bottom, simply exit the loop, rendering any more resources would be a waste of time and would look bad
             elif y + h > self._dims[1]:
                 break
-            surface.blit(blit, (x + w / 2, y + h / 2))
+            blits.append((atlas, (px + x + w / 2, py + y + h / 2), area))
             x += w + offset
-        return surface
+        surface.blits(blits, doreturn=False)
 
     def point_in_place(self, x, y):
         sx, sy = self.position
@@ -362,28 +828,104 @@ class Node(Place):
     def dims(self):
         return self._dims
 
+    def set_scheduler(self, scheduler):
+        # A cool-down never lasts longer than COOL_DOWN, this keeps a cool-down saved on another clock from blocking the node
+        self._next_available = min(self._next_available, scheduler.time() + self.COOL_DOWN)
+        super().set_scheduler(scheduler)
+
     def update(self):
-        if not self._working and not self._has_waiting_resources and self._next_available - time.time() < 0:
-            if self.get_resources():
-                thread = threading.Thread(target=self.use_resources, args=(1, ))
-                thread.setDaemon(True)
-                thread.start()
+        # A working node is woken up again once its resources are delivered, until then there is nothing to do
+        with self._thread_lock:
+            busy = self._working or self._has_waiting_resources
+        if busy:
+            return
+        if self._next_available - self._scheduler.time() >= 0:
+            self.wake_at(self._next_available)
+            return
+        revision = self._resources.revision
+        if self.get_resources():
+            with self._thread_lock:
+                self._working = True
+            self._scheduler.submit(self, self.WORK_DELAY)
+        elif self._resources.revision != revision:
+            # It took some of what it needs, the rest might be there on the next tick. Otherwise a container wakes it up when it gets something
+            self.wake()
+
+    def _routes_to(self, place):
+        return isinstance(place, Container)
+
+    def _fetch(self, t):
+        """
+            Takes a resource of a type from the first container supplying it that has one, returns a boolean if it got one.
+        """
+        with self._thread_lock:
+            suppliers = list(self._suppliers.get(t, ()))
+        for place in suppliers:
+            if place.place_resource(self, t):
+                return True
+        return False
 
     def get_resources(self):
         return False
-    def use_resources(self, delay=1):
+    def work_duration(self, delay=1):
+        """
+            Returns how long it takes before the resources are processed, the work cycle then lasts another delay/2.
+        """
+        return delay / 2
+    def process_resources(self):
         pass
+    def work(self, delay=1):
+        """
+            Generator of a full work cycle. It yields how many seconds to wait before it can be continued and is run by a scheduler.
+        """
+        try:
+            # The resources are changed on the scheduler's threads while the map is drawn, so they're only touched under the lock
+            with self._thread_lock:
+                self._working = True
+                duration = self.work_duration(delay)
+            yield duration
+            with self._thread_lock:
+                self.process_resources()
+            yield delay / 2
+        except Exception:
+            # A failed cycle leaves the node idle with what it holds, so it starts over instead of counting as working forever
+            with self._thread_lock:
+                self._working = False
+            self.wake()
+            raise
+        # Both flags change in one go, so update never sees a node that is neither working nor waiting in between
+        with self._thread_lock:
+            self._has_waiting_resources = True
+            self._working = False
+        # Only the containers this node delivers to have something to do now
+        for place in self._routed(self._consumers):
+            place.wake()
+    def use_resources(self, delay=1):
+        """
+            Runs a full work cycle on the wall clock, blocking until it is done.
+        """
+        for duration in self.work(delay):
+            time.sleep(duration)
     def give_resources(self, container):
         """
             If this Node has any resources waiting to be delivered, it will give any resources it can to the container. If a resource can't be given it will simply skip to the next one.
+
+            Returns how many resources it gave.
         """
+        given = 0
         if self._has_waiting_resources:
-            for resource in self._resources[:]:
-                if container.uses(type(resource)):
-                    container.insert(resource)
-                    self._resources.remove(resource)
-            self._has_waiting_resources = len(self._resources) != 0
-            self._next_available = time.time() + 0.2
+            first, second = ordered_locks(self, container)
+            with first, second:
+                for t, containers in self._consumers.items():
+                    if container in containers:
+                        while self._resources.count(t):
+                            container.insert(self._resources.pop(t))
+                            given += 1
+                self._has_waiting_resources = len(self._resources) != 0
+            self._next_available = self._scheduler.time() + self.COOL_DOWN
+            if not self._has_waiting_resources:
+                self.wake_at(self._next_available)
+        return given
 
 class Factory(Node):
     WORKER_DAMAGE = 0.1
@@ -394,27 +936,20 @@ class Factory(Node):
     def random_accident(self):
         return random.random() < self.CHANCE_OF_ACCIDENT
 
-    def use_resources(self, delay=1):
-        self._working = True
-
-        worker = self._resources[0]
+    def work_duration(self, delay=1):
+        worker = self._resources.first(Worker)
         viability_penalty = map_from_to(worker.viability, 0, 1, 2, 1)
-        time.sleep(delay/2 * viability_penalty)
-        for r in self._resources[:]:
-            if type(r) == Worker:
-                self._resources.append(Product())
-                if self.random_accident() or r.damage(self.WORKER_DAMAGE):
-                    self._resources.remove(r)
-
-        time.sleep(delay/2)
-        self._working = False
-        self._has_waiting_resources = True
+        return delay/2 * viability_penalty
+
+    def process_resources(self):
+        for r in self._resources.of_type(Worker):
+            self._resources.append(Product())
+            if self.random_accident() or r.damage(self.WORKER_DAMAGE):
+                self._resources.remove(r)
 
     def get_resources(self):
         if len(self._resources) == 0:
-            for place in self._ingoing_connections:
-                if isinstance(place, Container) and place.place_resource(self):
-                    break
+            self._fetch(Worker)
         return self._count_resources(Worker)[0] > 0
 
     def insert(self, r: Resource):
@@ -431,27 +966,20 @@ class Field(Node):
     def random_accident(self):
         return random.random() < self.CHANCE_OF_ACCIDENT
 
-    def use_resources(self, delay=1):
-        self._working = True
-        
-        worker = self._resources[0]
+    def work_duration(self, delay=1):
+        worker = self._resources.first(Worker)
         viability_penalty = map_from_to(worker.viability, 0, 1, 2, 1)
-        time.sleep(delay/2 * viability_penalty)
-        for r in self._resources[:]:
-            if type(r) == Worker:
-                self._resources.append(Food())
-                if self.random_accident():
-                    self._resources.remove(r)
-
-        time.sleep(delay/2)
-        self._working = False
-        self._has_waiting_resources = True
+        return delay/2 * viability_penalty
+
+    def process_resources(self):
+        for r in self._resources.of_type(Worker):
+            self._resources.append(Food())
+            if self.random_accident():
+                self._resources.remove(r)
 
     def get_resources(self):
         if len(self._resources) == 0:
-            for place in self._ingoing_connections:
-                if isinstance(place, Container) and place.place_resource(self):
-                    break
+            self._fetch(Worker)
         return self._count_resources(Worker)[0] > 0
 
     def insert(self, r: Resource):
@@ -466,35 +994,23 @@ class Flat(Node):
     def __init__(self, *args, **kwargs):
         super().__init__('Flat', (Worker, Product), (Worker, ), *args, **kwargs)
 
-    def use_resources(self, delay=1):
-        self._working = True
-
-        time.sleep(delay/2)
+    def process_resources(self):
         workers = self._count_resources(Worker)[0]
         if workers == 2:
             self._resources.append(Worker())
         else:
-            for resource in self._resources[:]:
-                if type(resource) == Worker:
-                    resource.add_viability(self.VIABILITY_INCREASE)
-        self._resources = [r for r in self._resources if type(r) != Product]
-
-        time.sleep(delay/2)
-        self._working = False
-        self._has_waiting_resources = True
+            for resource in self._resources.of_type(Worker):
+                resource.add_viability(self.VIABILITY_INCREASE)
+        self._resources.remove_all(Product)
 
     def get_resources(self):
         counts = self._count_resources((Product, Worker))
         count_sum = sum(counts)
         if counts[0] == 0:
-            for place in self._ingoing_connections:
-                if isinstance(place, Magazine) and place.place_resource(self):
-                    break
+            self._fetch(Product)
         elif counts[1] == 0:
             for _ in range(2):
-                for place in self._ingoing_connections:
-                    if isinstance(place, Road) and place.place_resource(self):
-                        break
+                self._fetch(Worker)
                 if random.random() > self.CHANCE_OF_TWO_WRKR or self._count_resources(Worker)[0] > 1:
                     break
         return counts[0] == 1 and counts[1] in (1, 2)
@@ -517,32 +1033,20 @@ class Diner(Node):
     def viability(self):
         return (self.FOOD_POISON_FACTOR if random.random() < self.FOOD_POISON_CHANCE else 1) * random.uniform(self.MIN_VIABILITY_INCREASE, self.MAX_VIABILITY_INCREASE)
 
-    def use_resources(self, delay=1):
-        self._working = True
-
-        time.sleep(delay/2)
-        worker = [r for r in self._resources if type(r) == Worker][0]
-        food = [r for r in self._resources if type(r) == Food][0]
+    def process_resources(self):
+        worker = self._resources.first(Worker)
+        self._resources.pop(Food)
 
-        self._resources.remove(food)
         if worker.add_viability(self.viability):
             self._resources.remove(worker)
 
-        time.sleep(delay/2)
-        self._working = False
-        self._has_waiting_resources = True
-
     def get_resources(self):
         counts = self._count_resources((Food, Worker))
         count_sum = sum(counts)
         if counts[0] == 0:
-            for place in self._ingoing_connections:
-                if isinstance(place, Barn) and place.place_resource(self):
-                    break
+            self._fetch(Food)
         if counts[1] == 0:
-            for place in self._ingoing_connections:
-                if isinstance(place, Road) and place.place_resource(self):
-                    break
+            self._fetch(Worker)
         return counts[0] > 0 and counts[1] > 0
 
     def insert(self, r: Resource):
@@ -559,12 +1063,12 @@ class Container(Place):
         self._radius = kwargs.get('radius', 60)
         kwargs['dims'] = (round(self._radius * 2.1), round(self._radius * 2.1))
         super().__init__(name, uses, produces, *args, **kwargs)
-        self._thread_lock = threading.Lock()
+        self._notified_revision = None  # The revision of the resources when the nodes taking from this container were last woken up
                 
     def dims(self):
         return self._dims
 
-    def blit(self):
+    def _draw_static(self):
         # Create a surface, get the midpoint
         surface = pygame.Surface(self._dims, pygame.SRCALPHA).convert_alpha()
         x, y = (self._dims[0] // 2, self._dims[1] // 2)
@@ -580,40 +1084,38 @@ class Container(Place):
         # The radius of this circle will be half of the original circle.
         has_connections_colour = (0, 200, 0) if self.has_required_connections() else (200, 0, 0)
         pygame.draw.circle(surface, has_connections_colour, (x, y), self._radius // 2, 0)
+        return surface
 
+    def _ring_layout(self):
         # We're going to render them in a circle
         # So we want a maximum amount of resources to render per "loop" inside the circle
-        max_resources_per_loop = 10
-
-        # Manage how many loops around the circle we have done
-        loop_counter = 1
-        loop_radius_diff = 0.2
-        r = self._radius * (1 - loop_radius_diff * loop_counter)
-
-        # We have to keep track of the angle we are at and increase it by a percentage of a full circle
-        angle = 0
-        angle_offset = -math.pi / 2
-        angle_delta = 2 * math.pi / max_resources_per_loop
+        # Every loop shrinks the radius by a fifth, so only four loops have any room left
+        return ring_layout(self._radius, 10, 4)
+
+    def resource_capacity(self):
+        return len(self._ring_layout())
+
+    def _summary_box(self):
+        # A square inside the circle, a bit smaller than the largest one so its corners stay off the border
+        side = self._radius * 1.3
+        return ((self._dims[0] - side) / 2, (self._dims[1] - side) / 2, side, side)
+
+    def _blit_resource_sprites(self, surface, position):
+        # The slots around the rings only depend on the radius, so they come from a table
+        layout = self._ring_layout()
+        centre = (self._dims[0] / 2, self._dims[1] / 2)
+        atlas = RESOURCE_ATLAS.surface
+        blits = []
+        i = 0
+        for t in self._resources.types():
+            # Every resource of a type shares its area of the atlas, so its slots are shifted all at once
+            area = RESOURCE_ATLAS.area(t)
+            c = self._resources.count(t)
+            dests = layout[i:i + c] + centre + position - (area.width / 2, area.height / 2)
+            blits.extend(zip(repeat(atlas), dests.tolist(), repeat(area)))
+            i += c
+        surface.blits(blits, doreturn=False)
 
-        for resource in self._resources:
-            # Compute the x-y coordinate and offset it so it's from the center of the circle
-            x, y = math.cos(angle + angle_offset) * r + self._dims[0] / 2, math.sin(angle + angle_offset) * r + self._dims[1] / 2
-            
-            # Get the resource's blit and dimensions
-            blit = resource.blit()
-            w, h = blit.get_size()
-            
-            # Blit it, increase the angle
-            surface.blit(blit, (x - w / 2, y - h / 2))
-            angle += angle_delta
-
-            # If we have gone a whole loop, reset angle, increase the loop counter and recalculate the radius
-            if angle > math.pi * 2:
-                loop_counter += 1
-                r = self._radius * (1 - loop_radius_diff * loop_counter)
-                angle = 0
-        return surface
-        
     def point_in_place(self, x, y):
         sx, sy = self.position
         w, h = self._dims
@@ -621,18 +1123,30 @@ class Container(Place):
             return False
         return True
 
-    def place_resource(self, node: Node):
-        with self._thread_lock:
-            for resource in self._resources:
-                if node.insert(resource):
-                    self._resources.remove(resource)
+    def _routes_to(self, place):
+        return isinstance(place, Node)
+
+    def place_resource(self, node: Node, t=None):
+        """
+            Gives the node a resource it accepts, only of type t if it's given. Returns a boolean if it got one.
+        """
+        first, second = ordered_locks(self, node)
+        with first, second:
+            # Whether a node accepts a resource only depends on its type, so only the first resource of each type has to be tried
+            for t in (t, ) if t else self._resources.types():
+                if self._resources.count(t) and node.insert(self._resources.first(t)):
+                    self._resources.pop(t)
                     return True
             return False
             
     def update(self):
-        for place in self._ingoing_connections:
-            if isinstance(place, Node):
-                place.give_resources(self)
+        for place in self._routed(self._suppliers):
+            place.give_resources(self)
+        # The nodes that take from this container only have to try again if it got something new
+        if self._resources and self._resources.revision != self._notified_revision:
+            self._notified_revision = self._resources.revision
+            for place in self._routed(self._consumers):
+                place.wake()
 
 class Magazine(Container):
     def __init__(self, *args, **kwargs):
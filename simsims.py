@@ -4,11 +4,12 @@ import os
 
 APPLICATION_NAME = 'SimSims'
 BACKGROUND_COLOUR = (255, 255, 255)
+PAN_SPEED = 600     # Pixels of the window per second that the camera pans with
+WAIT_TIMEOUT = 10   # Seconds that pausing and saving wait for the work cycles in progress at most
 
 pygame.init()
 pygame.display.set_caption(APPLICATION_NAME)
 
-import threading
 import json
 
 from sim_assets import bindings as keybindings
@@ -16,6 +17,8 @@ from sim_assets import UI, Panel, Button
 from sim_assets import Place, Node, Magazine, Barn, Road, Factory, Field, Flat, Diner
 from sim_assets import Worker, Food, Product
 from sim_assets import Map
+from sim_assets import text_cache
+from sim_assets import SimulationLoop
 
 class SimSims:
     def __init__(self, dims, *args, **kwargs):
@@ -30,7 +33,7 @@ class SimSims:
 
         self._running = False
 
-        self._framerate = kwargs.get('framerate', 60)
+        self._framerate = kwargs.get('framerate', 60)     # Frames rendered per second, the simulation ticks at its own rate
         self._clock = pygame.time.Clock()
 
         self._save_dir = kwargs.get('save_dir', './')
@@ -47,6 +50,20 @@ class SimSims:
                                     background_colour=(200, 0, 0), padx=25, pady=10, keybinding=keybindings.PAUSE_START)
         self._pause_button.hide()
         self._ui.add_button(self._pause_button)
+
+        ## Time scale, the text of the button follows the time scale of the loop
+        self._time_scale_button = Button(f'Speed {kwargs.get("time_scale", 1):g}x', self._mid_font, (dims[0] / 2 - 70, 60), (120, 20),
+                                         func=lambda: self._loop.faster(), background_colour=(200, 200, 200), text_colour=(0, 0, 0))
+        self._time_scale_button.hide()
+        self._ui.add_button(self._time_scale_button)
+        self._max_speed_buttons = {}
+        for max_speed in (False, True):
+            btn = Button(f'Max speed {"on" if max_speed else "off"}', self._mid_font, (dims[0] / 2 + 70, 60), (120, 20),
+                         func=lambda: self._loop.set_max_speed(not self._loop.max_speed),
+                         background_colour=(200, 0, 0) if max_speed else (200, 200, 200), text_colour=(0, 0, 0), keybinding=keybindings.MAX_SPEED)
+            btn.hide()
+            self._max_speed_buttons[max_speed] = btn
+            self._ui.add_button(btn)
         ## KEYBINDS
         self._show_keybind_panel = False
         self._toggle_keybindings_button = Button('Show Keybindigs', self._mid_font, (5, 5), (80, 20), func=self._toggle_keybindings_panel,
@@ -62,12 +79,21 @@ class SimSims:
         self._keybind_panel.add_text(f'{keybindings.name_of_key(keybindings.EXIT).ljust(text_l_just)} - Exit'                                          , self._keybindings_font)
         self._keybind_panel.add_text(f'{keybindings.name_of_key(keybindings.LOAD_SCREEN).ljust(text_l_just)} - Toggle load screen', self._keybindings_font)
         self._keybind_panel.add_text(f'{keybindings.name_of_key(keybindings.PAUSE_START).ljust(text_l_just)} - Pause / Start'                          , self._keybindings_font)
+        self._keybind_panel.add_text(f'{keybindings.name_of_key(keybindings.FASTER).ljust(text_l_just)} - Faster'                                     , self._keybindings_font)
+        self._keybind_panel.add_text(f'{keybindings.name_of_key(keybindings.SLOWER).ljust(text_l_just)} - Slower'                                     , self._keybindings_font)
+        self._keybind_panel.add_text(f'{keybindings.name_of_key(keybindings.MAX_SPEED).ljust(text_l_just)} - Max speed'                               , self._keybindings_font)
         self._keybind_panel.add_text('', self._keybindings_font)
         self._keybind_panel.add_text(f'{keybindings.name_of_key(keybindings.INTERACT).ljust(text_l_just)} - Build/Select'                              , self._keybindings_font)
         self._keybind_panel.add_text(f'{keybindings.name_of_key(keybindings.DESELECT).ljust(text_l_just)} - Remove selection'                          , self._keybindings_font)
         self._keybind_panel.add_text(f'{keybindings.name_of_key(keybindings.DELETE_PLACE).ljust(text_l_just)} - Delete a place'                        , self._keybindings_font)
         self._keybind_panel.add_text(f'{keybindings.name_of_key(keybindings.DISCONNECT_PLACE_CONNECTIONS).ljust(text_l_just)} - Disconnect connections', self._keybindings_font)
         self._keybind_panel.add_text('', self._keybindings_font)
+        self._keybind_panel.add_text(f'{"Arrow keys".ljust(text_l_just)} - Pan'                                                                      , self._keybindings_font)
+        self._keybind_panel.add_text(f'{"Mouse wheel".ljust(text_l_just)} - Zoom'                                                                    , self._keybindings_font)
+        self._keybind_panel.add_text(f'{keybindings.name_of_key(keybindings.ZOOM_IN).ljust(text_l_just)} - Zoom in'                                   , self._keybindings_font)
+        self._keybind_panel.add_text(f'{keybindings.name_of_key(keybindings.ZOOM_OUT).ljust(text_l_just)} - Zoom out'                                 , self._keybindings_font)
+        self._keybind_panel.add_text(f'{keybindings.name_of_key(keybindings.RESET_CAMERA).ljust(text_l_just)} - Reset camera'                         , self._keybindings_font)
+        self._keybind_panel.add_text('', self._keybindings_font)
         self._keybind_panel.add_text(f'{keybindings.name_of_key(keybindings.KEYBINDING_SCREEN).ljust(text_l_just)} - Show keybindings'                 , self._keybindings_font)
         self._keybind_panel.hide()
 
@@ -105,7 +131,7 @@ class SimSims:
         select_btn_width  = self._dims[0] / len(selections)
         select_btn_height = 30
         for i, t in enumerate(selections):
-            place = t(set_index=False)
+            place = t()
             key = getattr(keybindings, f'SELECT_TYPE_{place.name.upper()}')
             btn = Button(f'{place.name} ({keybindings.name_of_key(key)})', self._main_font,
                     ((i + 0.5) * select_btn_width, self._dims[1] - select_btn_height * 0.75), (select_btn_width, select_btn_height),
@@ -124,42 +150,78 @@ class SimSims:
                     keybinding=key)
             self._ui.add_button(btn)
 
-        self._map = Map()
+        self._map = Map(kwargs.get('scheduler', None))
+        self._loop = SimulationLoop(self._map, kwargs.get('tick_rate', 60))
+        self._loop.set_time_scale(kwargs.get('time_scale', 1))
         self._started_sim = False
 
+        # What was drawn last frame, so render only has to update what changed
+        self._full_redraw = True
+        self._drawn_preview_rect = None
+        self._drawn_ui_state = []
+
     def start(self):
         """
             Starts the application.
         """
-        thread_lock = threading.Lock()
         self._running = True
         while self._running:
             delta_time = self._clock.tick(self._framerate) * 0.001 # Mult by 0.001 to get it in milliseconds
 
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT: self.exit()
-                if event.type == pygame.MOUSEBUTTONDOWN:
-                    self.handle_input(*event.pos, event.button)
-                if event.type == pygame.KEYDOWN:
-                    self.handle_input(*pygame.mouse.get_pos(), event.key)
+            # The simulation loop doesn't tick while the map is changed or drawn
+            with self._loop.lock:
+                self._handle_events(delta_time)
+                self._update_time_scale_buttons()
+                self.render()
 
-            if self._started_sim:
-                for node in self._map.places:
-                    node.update()
+    def _handle_events(self, delta_time):
+        """
+            Handles the events of a frame.
+        """
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT: self.exit()
+            if event.type == pygame.VIDEOEXPOSE: self._full_redraw = True
+            if event.type == pygame.MOUSEBUTTONDOWN:
+                self.handle_input(*event.pos, event.button)
+            if event.type == pygame.KEYDOWN:
+                self.handle_input(*pygame.mouse.get_pos(), event.key)
 
-            with thread_lock:
-                self.render()
+        self._pan_camera(delta_time)
+
+    def _update_time_scale_buttons(self):
+        """
+            Shows the current time scale on its button and the button of the current max speed setting.
+        """
+        self._time_scale_button.set_text(f'Speed {self._loop.time_scale:g}x')
+        shown = [self._time_scale_button, self._max_speed_buttons[self._loop.max_speed]]
+        for btn in [self._time_scale_button] + list(self._max_speed_buttons.values()):
+            if btn in shown:
+                btn.unhide()
+            else:
+                btn.hide()
+
+    def _pan_camera(self, delta_time):
+        """
+            Pans the camera for as long as the pan keys are held down.
+        """
+        keys = pygame.key.get_pressed()
+        dx = keys[keybindings.PAN_RIGHT] - keys[keybindings.PAN_LEFT]
+        dy = keys[keybindings.PAN_DOWN] - keys[keybindings.PAN_UP]
+        if dx or dy:
+            self._map.camera.pan(round(dx * PAN_SPEED * delta_time), round(dy * PAN_SPEED * delta_time))
 
     def start_simulation(self):
         """
             Starts the simulation.
         """
         self._started_sim = True
+        self._loop.start()
         self._start_button.hide()
         self._pause_button.unhide()
 
     def pause_simulation(self):
         self._started_sim = False
+        self._loop.stop()
         self._wait_threads()
         self._start_button.unhide()
         self._pause_button.hide()
@@ -168,9 +230,9 @@ class SimSims:
         """
             Wrapper for Map._wait_threads:
 
-                It waits for any threads to finish before continuing.
+                It waits for any threads to finish before continuing, for WAIT_TIMEOUT seconds at most.
         """
-        self._map._wait_threads()
+        return self._map._wait_threads(WAIT_TIMEOUT)
     
     def _toggle_keybindings_panel(self):
         """
@@ -198,12 +260,23 @@ class SimSims:
 
     def handle_input(self, mouse_x, mouse_y, button):
         """
-            Handles keyboard input.
+            Handles keyboard input, the mouse position is in the window and converted to the map by the camera.
         """
-        if button == keybindings.DISCONNECT_PLACE_CONNECTIONS:
-            self.disconnect_connection(mouse_x, mouse_y)
+        map_x, map_y = self._map.camera.to_world(mouse_x, mouse_y)
+        if button in (keybindings.ZOOM_IN, keybindings.WHEEL_ZOOM_IN):
+            self._map.camera.zoom_at(1, mouse_x, mouse_y)
+        elif button in (keybindings.ZOOM_OUT, keybindings.WHEEL_ZOOM_OUT):
+            self._map.camera.zoom_at(-1, mouse_x, mouse_y)
+        elif button == keybindings.RESET_CAMERA:
+            self._map.camera.reset()
+        elif button == keybindings.FASTER:
+            self._loop.faster()
+        elif button == keybindings.SLOWER:
+            self._loop.slower()
+        elif button == keybindings.DISCONNECT_PLACE_CONNECTIONS:
+            self.disconnect_connection(map_x, map_y)
         elif button == keybindings.DELETE_PLACE:
-            self.delete_place_at(mouse_x, mouse_y)
+            self.delete_place_at(map_x, map_y)
         elif button == keybindings.INTERACT:
             btn = None
             for button in self._ui.buttons:
@@ -213,9 +286,9 @@ class SimSims:
                 btn.call()
             else:
                 if self._map.can_build():
-                    self._map.build(mouse_x, mouse_y)
+                    self._map.build(map_x, map_y)
                 else:
-                    self._map.select_building_at(mouse_x, mouse_y)
+                    self._map.select_building_at(map_x, map_y)
         elif button == keybindings.DESELECT:
             self._map.deselect_selections()
         else:
@@ -240,31 +313,73 @@ class SimSims:
         """
             Exits the simulation.
         """
+        self._loop.stop()
         sys.exit()
 
     def render(self):
         """
-            Renders the simulation and flips the display's pixels.
+            Renders the simulation and updates the parts of the display that changed.
         """
-        self._window.fill(BACKGROUND_COLOUR)
-        self._window.blit(self._map.blit(self._dims, self._places_name_font), (0, 0))
+        map_blit, dirty = self._map.render(self._dims, self._places_name_font)
 
-        # Renders the preview of what is about to be built if possible
+        # The preview of what is about to be built follows the mouse
+        preview = None
         build_preview, text = self._map.selected_build_preview()
         if build_preview:
-            w, h = build_preview.get_size()
+            # The preview is shown at the size it will have on the map
+            zoom = self._map.camera.zoom
+            if zoom != 1:
+                w, h = build_preview.get_size()
+                build_preview = pygame.transform.smoothscale(build_preview, (max(1, round(w * zoom)), max(1, round(h * zoom))))
             mx, my = pygame.mouse.get_pos()
-            self._window.blit(build_preview, (mx - w / 2, my - h / 2))
-
-            text_blit = self._places_name_font.render(text, True, (0, 0, 0))
+            text_blit = text_cache.render(self._places_name_font, text, True, (0, 0, 0))
+            w, h = build_preview.get_size()
             tw, th = text_blit.get_size()
-            self._window.blit(text_blit, (mx - tw / 2, my - th / 2))
+            preview = ((build_preview, (mx - w / 2, my - h / 2)), (text_blit, (mx - tw / 2, my - th / 2)))
+        preview_rect = pygame.Rect(preview[0][1], build_preview.get_size()).inflate(2, 2) if preview else None
+        if preview_rect != self._drawn_preview_rect:
+            dirty += [r for r in (preview_rect, self._drawn_preview_rect) if r]
+        self._drawn_preview_rect = preview_rect
+
+        # UI elements that were hidden, shown, moved or redrawn
+        ui_state = [(ui_element.hidden, ui_element.position, ui_element.blit) for ui_element in self._ui]
+        if len(ui_state) != len(self._drawn_ui_state):
+            self._full_redraw = True
+        else:
+            for new, old in zip(ui_state, self._drawn_ui_state):
+                if new != old:
+                    dirty += [pygame.Rect(position, blit.get_size()).inflate(2, 2) for _, position, blit in (new, old)]
+        self._drawn_ui_state = ui_state
+
+        if self._full_redraw:
+            dirty = [self._window.get_rect()]
+        for rect in dirty:
+            self._window.set_clip(rect)
+            self._draw_frame(map_blit, preview)
+        self._window.set_clip(None)
+
+        if self._full_redraw:
+            pygame.display.flip()
+            self._full_redraw = False
+        elif dirty:
+            pygame.display.update(dirty)
+
+    def _draw_frame(self, map_blit, preview):
+        """
+            Draws everything onto the window, only the window's clip rectangle is changed.
+        """
+        self._window.fill(BACKGROUND_COLOUR)
+        self._window.blit(map_blit, (0, 0))
+
+        # Renders the preview of what is about to be built if possible
+        if preview:
+            for blit, position in preview:
+                self._window.blit(blit, position)
 
         # Render all the UI elements
         for ui_element in self._ui:
             if not ui_element.hidden:
                 self._window.blit(ui_element.blit, ui_element.position)
-        pygame.display.flip()
 
     # Loading and saving
 
@@ -307,7 +422,8 @@ class SimSims:
             obj = json.dump(map_json, f)
 
         self._update_load_panel()
-        self._started_sim = state
+        if state:
+            self.start_simulation()
 
     def _update_load_panel(self, content_height=20):
         """